@@ -2,89 +2,100 @@
 import os
 import sys
 import time
-from email import utils
 import logging
 
 import redis
-import simplejson as json
 
 import bitcoinaverage as ba
 import bitcoinaverage.server
-from bitcoinaverage import api_custom_writers
+from bitcoinaverage import fiat_rates
+from bitcoinaverage import rolling_averages
+from bitcoinaverage import tracing
+from bitcoinaverage import api_files
+from bitcoinaverage import api_server
 from bitcoinaverage.config import API_WRITE_FREQUENCY, FIAT_RATES_QUERY_FREQUENCY
 import bitcoinaverage.helpers as helpers
-from bitcoinaverage.api_calculations import calculateTotalVolumes, calculateRelativeVolumes, calculateAverageRates, formatDataForAPI, writeAPIFiles, calculateAllGlobalAverages
+from bitcoinaverage.api_pipeline import APIPipeline
+from bitcoinaverage.cycle_log import CycleRecorder
+from bitcoinaverage.api_snapshots import APISnapshots
 
 logger = logging.getLogger("api_daemon")
 
 logger.info("script started")
+tracing.tracer.configure('api_daemon')
+
+api_snapshots = None
+if getattr(ba.server, 'API_SERVER_ADDRESS', ''):
+    # API documents are kept in memory and served from there, nothing is written to API_DOCUMENT_ROOT
+    api_files.writer.store = api_server.store
+    api_server.start(ba.server.API_SERVER_ADDRESS)
+elif getattr(ba.server, 'API_SNAPSHOTS_ROOT', ''):
+    api_snapshots = APISnapshots(ba.server.API_SNAPSHOTS_ROOT)
+    # files written between cycles (index files, fiat_data) go to the working generation as well
+    ba.server.API_DOCUMENT_ROOT = api_snapshots.begin()
+
 helpers.write_js_config()
+fiat_rates.cache.load()
 helpers.write_fiat_rates_config()
 last_fiat_exchange_rate_update = time.time()
 helpers.write_api_index_files()
+helpers.write_exchanges_metadata()
+rolling_averages.rebuild_from_history()
 
 red = redis.StrictRedis(host="localhost", port=6379, db=0)
+pipeline = APIPipeline(ba.server.API_DOCUMENT_ROOT)
+
+cycle_recorder = None
+if getattr(ba.server, 'API_CYCLE_LOG_PATH', ''):
+    cycle_recorder = CycleRecorder(ba.server.API_CYCLE_LOG_PATH)
 
 while True:
     if last_fiat_exchange_rate_update < int(time.time())-FIAT_RATES_QUERY_FREQUENCY:
         helpers.write_fiat_rates_config()
+        last_fiat_exchange_rate_update = int(time.time())
 
-    start_time = int(time.time())
+    start_time = time.time()
 
     if not red.exists("ba:exchanges"):
         logger.warning("database is empty")
         time.sleep(API_WRITE_FREQUENCY)
         continue
-    exchanges_rates = []
-    exchanges_ignored = {}
-    for exchange_data in red.hgetall("ba:exchanges").itervalues():
-        exchanges_rates.append(json.loads(exchange_data, use_decimal=True))
-    for exchange_name, exchange_ignore_reason in red.hgetall("ba:exchanges_ignored").iteritems():
-        exchanges_ignored[exchange_name] = exchange_ignore_reason
-
-    total_currency_volumes, total_currency_volumes_ask, total_currency_volumes_bid = calculateTotalVolumes(exchanges_rates)
-    calculated_volumes = calculateRelativeVolumes(exchanges_rates,
-                                                  total_currency_volumes,
-                                                  total_currency_volumes_ask,
-                                                  total_currency_volumes_bid)
-    calculated_average_rates = calculateAverageRates(exchanges_rates, calculated_volumes)
-
-    calculated_global_average_rates, calculated_global_volume_percents = calculateAllGlobalAverages(calculated_average_rates,
-                                                                                                    total_currency_volumes)
-
-    (calculated_average_rates_formatted,
-     calculated_volumes_formatted,
-     calculated_global_average_rates_formatted) = formatDataForAPI(calculated_average_rates,
-                                                                   calculated_volumes,
-                                                                   total_currency_volumes,
-                                                                   calculated_global_average_rates,
-                                                                   calculated_global_volume_percents)
-
-    human_timestamp = utils.formatdate(time.time())
-    writeAPIFiles(ba.server.API_DOCUMENT_ROOT,
-                  human_timestamp,
-                  calculated_average_rates_formatted,
-                  calculated_volumes_formatted,
-                  calculated_global_average_rates_formatted,
-                  exchanges_ignored)
-
-    api_custom_writers.createCustomAPIs(ba.server.API_DOCUMENT_ROOT,
-                                        human_timestamp,
-                                        calculated_average_rates_formatted,
-                                        calculated_volumes_formatted,
-                                        calculated_global_average_rates_formatted,
-                                        exchanges_ignored)
-
-
-    if last_fiat_exchange_rate_update < int(time.time())-FIAT_RATES_QUERY_FREQUENCY:
-        helpers.write_sitemap()
-        last_fiat_exchange_rate_update = int(time.time())
 
-    cycle_time = int(time.time()) - start_time
+    with tracing.span('cycle'):
+        with tracing.span('fetch_redis'):
+            raw_exchanges = red.hgetall("ba:exchanges")
+            exchanges_ignored = {}
+            for exchange_name, exchange_ignore_reason in red.hgetall("ba:exchanges_ignored").iteritems():
+                exchanges_ignored[exchange_name] = exchange_ignore_reason
+
+        current_time = time.time()
+        if cycle_recorder is not None:
+            with tracing.span('record_cycle'):
+                cycle_recorder.record(current_time, raw_exchanges, exchanges_ignored, fiat_rates.cache)
+
+        pipeline.api_document_root = ba.server.API_DOCUMENT_ROOT
+        human_timestamp = pipeline.run_cycle(raw_exchanges, exchanges_ignored, current_time, start_time)
+
+        if api_snapshots is not None:
+            with tracing.span('publish_snapshot'):
+                api_snapshots.publish()
+            with tracing.span('link_snapshot'):
+                ba.server.API_DOCUMENT_ROOT = api_snapshots.begin()
+    pipeline.reportMetrics()
+    if api_files.writer.store is not None:
+        for name, count in api_server.store.stats.iteritems():
+            tracing.tracer.setValue('ba_api_server_{0}_total'.format(name), count, 'counter')
+        tracing.tracer.setValue('ba_api_server_stream_connections', api_server.stream_hub.connections)
+    tracing.tracer.flush()
+
+    cycle_time = int(time.time() - start_time)
     sleep_time = max(0, API_WRITE_FREQUENCY - cycle_time)
-    logger.info("{timestamp}, spent {spent}s, sleeping {sleep}s - api daemon".format(
+    logger.info("{timestamp}, spent {spent}s, {written} files written, {skipped} unchanged, {syscalls} file syscalls, sleeping {sleep}s - api daemon".format(
         timestamp=human_timestamp,
         spent=cycle_time,
+        written=pipeline.files_written,
+        skipped=pipeline.files_skipped,
+        syscalls=sum(pipeline.syscalls.itervalues()),
         sleep=str(sleep_time)))
 
     time.sleep(sleep_time)
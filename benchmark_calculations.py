@@ -0,0 +1,259 @@
+#!/usr/bin/python2.7
+"""
+Benchmarks api_calculations functions on synthetic exchange data.
+
+Scales are given as <exchanges>x<currencies>x<fiat currencies>, every exchange quotes a random share
+of currencies and a share of rates/volumes is missing (None). Fiat rates and 24h history are local,
+no redis or network is used. The JSON report can be passed back with --baseline to detect regressions.
+
+usage: benchmark_calculations.py [--scales 50x21x170,2000x200x170] [--output report.json]
+                                 [--baseline old_report.json] [--threshold 1.25]
+"""
+import sys
+import gc
+import time
+import copy
+import json
+import random
+import argparse
+import resource
+import platform
+import logging
+from decimal import Decimal
+
+import bitcoinaverage as ba
+from bitcoinaverage import api_calculations
+from bitcoinaverage import fiat_rates
+from bitcoinaverage.config import CURRENCY_LIST, DEC_PLACES
+
+logger = logging.getLogger("benchmark_calculations")
+
+DEFAULT_SCALES = '50x21x170,200x50x170,500x100x170,2000x200x170'
+
+
+def _decimal(random_generator, low, high):
+    return Decimal(random_generator.uniform(low, high)).quantize(DEC_PLACES)
+
+
+def generateExchangesRates(exchanges_count, currencies, density, missing_share, seed):
+    random_generator = random.Random(seed)
+    exchanges_rates = []
+    for index in range(exchanges_count):
+        exchange_name = 'exchange{0:04d}'.format(index)
+        exchange_rate = {'exchange_name': exchange_name,
+                         'exchange_display_name': exchange_name.title(),
+                         'exchange_display_URL': 'https://{0}.example.com/'.format(exchange_name),
+                         'data_source': 'api',
+                         }
+        for currency in currencies:
+            if random_generator.random() > density:
+                continue
+            ticker = {'last': _decimal(random_generator, 100, 1000),
+                      'ask': _decimal(random_generator, 100, 1000),
+                      'bid': _decimal(random_generator, 100, 1000),
+                      'volume': _decimal(random_generator, 0, 5000),
+                      }
+            for key in ('last', 'ask', 'bid', 'volume'):
+                if random_generator.random() < missing_share:
+                    ticker[key] = None
+            exchange_rate[currency] = ticker
+        exchanges_rates.append(exchange_rate)
+
+    # exchanges quoting a currency with volume but no ask/bid make ask/bid volume totals zero
+    for currency in currencies:
+        for exchange_rate in exchanges_rates:
+            if currency in exchange_rate and exchange_rate[currency]['volume'] > 0:
+                exchange_rate[currency]['ask'] = exchange_rate[currency]['ask'] or Decimal('100.00')
+                exchange_rate[currency]['bid'] = exchange_rate[currency]['bid'] or Decimal('100.00')
+                break
+    return exchanges_rates
+
+
+def generateFiatRates(currencies, fiat_count, seed):
+    random_generator = random.Random(seed)
+    fiat_currencies = list(currencies)
+    index = 0
+    while len(fiat_currencies) < fiat_count:
+        fiat_currencies.append('F{0:03d}'.format(index))
+        index = index + 1
+    return dict((currency_code, {'name': currency_code, 'rate': str(_decimal(random_generator, 0.1, 50))})
+                for currency_code in fiat_currencies)
+
+
+class SyntheticUniverse(object):
+    """
+    Replaces currency and exchange lists used by the calculation modules for the duration of a benchmark,
+    functions with a currencies argument get the synthetic currencies passed explicitly
+    """
+
+    def __init__(self, exchanges_rates, currencies, fiat_currencies):
+        self.exchanges_rates = exchanges_rates
+        self.currencies = currencies
+        self.fiat_currencies = fiat_currencies
+        self.saved = None
+
+    def __enter__(self):
+        self.saved = (api_calculations.CURRENCY_LIST, api_calculations.EXCHANGE_LIST,
+                      fiat_rates.CURRENCY_LIST, fiat_rates.cache)
+        api_calculations.CURRENCY_LIST = self.currencies
+        api_calculations.EXCHANGE_LIST = dict((exchange_rate['exchange_name'], {}) for exchange_rate in self.exchanges_rates)
+        fiat_rates.CURRENCY_LIST = self.currencies
+        fiat_rates.cache = fiat_rates.FiatRatesCache()
+        fiat_rates.cache.update(self.fiat_currencies, persist=False)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        (api_calculations.CURRENCY_LIST, api_calculations.EXCHANGE_LIST,
+         fiat_rates.CURRENCY_LIST, fiat_rates.cache) = self.saved
+
+
+def measure(function, prepare, repeat):
+    """
+    Runs function(*prepare()) repeat times, prepare is not timed. python2 has no allocation counters,
+    allocations are measured as objects tracked by the garbage collector that the call left alive.
+    """
+    timings = []
+    allocations = []
+    result = None
+    for index in range(repeat):
+        result = None
+        arguments = prepare()
+        gc.collect()
+        gc.disable()
+        try:
+            allocations_before = len(gc.get_objects())
+            start_time = time.time()
+            result = function(*arguments)
+            timings.append(time.time() - start_time)
+            allocations.append(len(gc.get_objects()) - allocations_before)
+        finally:
+            gc.enable()
+    timings.sort()
+    return result, {'seconds_min': timings[0],
+                    'seconds_median': timings[len(timings) // 2],
+                    'retained_objects': min(allocations),
+                    }
+
+
+def benchmarkScale(exchanges_count, currencies_count, fiat_count, density, missing_share, repeat, seed):
+    currencies = tuple(CURRENCY_LIST[:currencies_count])
+    currencies = currencies + tuple('C{0:03d}'.format(index) for index in range(currencies_count - len(currencies)))
+    exchanges_rates = generateExchangesRates(exchanges_count, currencies, density, missing_share, seed)
+    fiat_currencies = generateFiatRates(currencies, fiat_count, seed)
+
+    results = {}
+    with SyntheticUniverse(exchanges_rates, currencies, fiat_currencies):
+        totals, results['calculateTotalVolumes'] = measure(
+            api_calculations.calculateTotalVolumes,
+            lambda: (copy.deepcopy(exchanges_rates), currencies),
+            repeat)
+        total_currency_volumes, total_currency_volumes_ask, total_currency_volumes_bid = totals
+
+        calculated_volumes, results['calculateRelativeVolumes'] = measure(
+            api_calculations.calculateRelativeVolumes,
+            lambda: (copy.deepcopy(exchanges_rates), total_currency_volumes, total_currency_volumes_ask,
+                     total_currency_volumes_bid, currencies),
+            repeat)
+
+        calculated_average_rates, results['calculateAverageRates'] = measure(
+            api_calculations.calculateAverageRates,
+            lambda: (copy.deepcopy(exchanges_rates), calculated_volumes, currencies),
+            repeat)
+
+        global_averages, results['calculateAllGlobalAverages'] = measure(
+            api_calculations.calculateAllGlobalAverages,
+            lambda: (calculated_average_rates, total_currency_volumes),
+            repeat)
+        calculated_global_average_rates, calculated_global_volume_percents = global_averages
+
+        result, results['formatDataForAPI'] = measure(
+            api_calculations.formatDataForAPI,
+            lambda: (copy.deepcopy(calculated_average_rates), copy.deepcopy(calculated_volumes),
+                     total_currency_volumes, copy.deepcopy(calculated_global_average_rates),
+                     calculated_global_volume_percents),
+            repeat)
+
+        def calculateAllCurrenciesForAPI(exchange_records):
+            return [api_calculations.calculateCurrencyForAPI(
+                        currency,
+                        [exchange.tickers[currency_id] for exchange in exchange_records
+                         if exchange.tickers[currency_id] is not None])
+                    for currency_id, currency in enumerate(currencies)]
+
+        result, results['calculateCurrencyForAPI'] = measure(
+            calculateAllCurrenciesForAPI,
+            lambda: ([api_calculations.createExchangeRecord(exchange_rate) for exchange_rate in exchanges_rates],),
+            repeat)
+    return results
+
+
+def compareReports(report, baseline, threshold):
+    regressions = []
+    for scale in report['results']:
+        if scale not in baseline.get('results', {}):
+            continue
+        for function_name, timing in report['results'][scale].iteritems():
+            baseline_timing = baseline['results'][scale].get(function_name)
+            if baseline_timing is None or baseline_timing['seconds_min'] <= 0:
+                continue
+            ratio = timing['seconds_min'] / baseline_timing['seconds_min']
+            timing['baseline_ratio'] = round(ratio, 3)
+            if ratio > threshold:
+                regressions.append('{0} {1}: {2:.4f}s vs {3:.4f}s baseline ({4:.2f}x)'.format(
+                    scale, function_name, timing['seconds_min'], baseline_timing['seconds_min'], ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark api_calculations on synthetic exchange universes')
+    parser.add_argument('--scales', default=DEFAULT_SCALES,
+                        help='comma separated <exchanges>x<currencies>x<fiat currencies>, default %(default)s')
+    parser.add_argument('--density', type=float, default=0.2, help='share of currencies quoted by an exchange')
+    parser.add_argument('--missing', type=float, default=0.05, help='share of missing (None) rates and volumes')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write JSON report to this file instead of stdout')
+    parser.add_argument('--baseline', help='JSON report of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='slowdown ratio against baseline reported as regression, default %(default)s')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    report = {'created': int(time.time()),
+              'python': platform.python_version(),
+              'parameters': {'density': args.density,
+                             'missing': args.missing,
+                             'repeat': args.repeat,
+                             'seed': args.seed,
+                             },
+              'results': {},
+              }
+    for scale in args.scales.split(','):
+        exchanges_count, currencies_count, fiat_count = [int(value) for value in scale.split('x')]
+        sys.stderr.write('benchmarking {0}\n'.format(scale))
+        report['results'][scale] = benchmarkScale(exchanges_count, currencies_count, fiat_count,
+                                                  args.density, args.missing, args.repeat, args.seed)
+    report['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, 'r') as baseline_file:
+            baseline = json.loads(baseline_file.read())
+        regressions = compareReports(report, baseline, args.threshold)
+        report['regressions'] = regressions
+
+    report_string = json.dumps(report, indent=2, sort_keys=True, separators=(',', ': '))
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            report_file.write(report_string)
+    else:
+        print report_string
+
+    for regression in regressions:
+        sys.stderr.write('regression: {0}\n'.format(regression))
+    return 1 if len(regressions) > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
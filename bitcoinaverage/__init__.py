@@ -19,6 +19,10 @@ if not server.WWW_DOCUMENT_ROOT:
     server.WWW_DOCUMENT_ROOT = os.path.join(project_root, 'www')
 if not server.HISTORY_DOCUMENT_ROOT:
     server.HISTORY_DOCUMENT_ROOT = os.path.join(project_root, 'api', 'history')
+if not getattr(server, 'FIAT_RATES_CACHE_PATH', ''):
+    server.FIAT_RATES_CACHE_PATH = os.path.join(project_root, 'runtime', 'fiat_rates.json')
+if not getattr(server, 'METRICS_PATH', ''):
+    server.METRICS_PATH = os.path.join(project_root, 'runtime', 'metrics')
 
 # Set up logging
 log_config = {
@@ -47,3 +51,7 @@ log_config = {
     },
 }
 logging.config.dictConfig(log_config)
+
+# on-demand sampling profiler, see profiler.py
+from bitcoinaverage.profiler import profiler
+profiler.install()
@@ -1,129 +1,43 @@
 import os
 import subprocess
 import sys
-import csv
+import hashlib
 from copy import deepcopy
-import StringIO
-from decimal import Decimal, InvalidOperation
+from decimal import Decimal
 import simplejson
-from eventlet.green import urllib2
-from eventlet.green import httplib
-from eventlet.timeout import Timeout
-import socket
-import json
 import logging
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 import bitcoinaverage as ba
-import bitcoinaverage.server as server
-from bitcoinaverage.config import DEC_PLACES, API_CALL_TIMEOUT_THRESHOLD, API_REQUEST_HEADERS, CURRENCY_LIST, API_FILES, EXCHANGE_LIST, INDEX_DOCUMENT_NAME
-from bitcoinaverage.exceptions import CallTimeoutException
+from bitcoinaverage.config import DEC_PLACES, CURRENCY_LIST, API_FILES, EXCHANGE_LIST, INDEX_DOCUMENT_NAME
+from bitcoinaverage.config import API_DELTA_DOCUMENTS, API_VERSION_FAMILIES, API_BUNDLE_SPARKLINE_SECONDS
+from bitcoinaverage import fiat_rates
+from bitcoinaverage import rolling_averages
+from bitcoinaverage import json_fragments
+from bitcoinaverage import api_deltas
 import bitcoinaverage.helpers as helpers
 
 logger = logging.getLogger(__name__)
 
 
 def get24hAverage(currency_code):
-    history_currency_API_24h_path = "{0}/per_minute_24h_sliding_window.csv".format(
-        getattr(server, "API_INDEX_URL_HISTORY_OVERRIDE", server.API_INDEX_URL_HISTORY) + currency_code)
+    return rolling_averages.prices_24h.average(currency_code)
 
-    try:
-        with Timeout(API_CALL_TIMEOUT_THRESHOLD, CallTimeoutException):
-            csv_result = urllib2.urlopen(urllib2.Request(url=history_currency_API_24h_path, headers=API_REQUEST_HEADERS)).read()
-    except (
-            KeyError,
-            ValueError,
-            socket.error,
-            simplejson.decoder.JSONDecodeError,
-            urllib2.URLError,
-            httplib.BadStatusLine,
-            CallTimeoutException) as error:
-        logger.error("can not get history data from {0}: {1}".format(
-            history_currency_API_24h_path,
-            str(error)))
-        return DEC_PLACES
-
-    csvfile = StringIO.StringIO(csv_result)
-    csvreader = csv.reader(csvfile, delimiter=',')
-    price_sum = DEC_PLACES
-    index = 0
-    header_passed = False
-    for row in csvreader:
-        if not header_passed:
-            header_passed = True
-            continue
-        try:
-            price_sum = price_sum + Decimal(row[1])
-            index = index + 1
-        except (IndexError, InvalidOperation):
-            continue
-    try:
-        average_price = (price_sum / Decimal(index)).quantize(DEC_PLACES)
-    except InvalidOperation:
-        average_price = DEC_PLACES
-
-    return average_price
 
 def get24hGlobalAverage(currency_code):
-
     if currency_code not in CURRENCY_LIST:
         return DEC_PLACES
 
-    history_currency_API_24h_path = "{0}/per_minute_24h_global_average_sliding_window.csv".format(
-        getattr(server, "API_INDEX_URL_HISTORY_OVERRIDE", server.API_INDEX_URL_HISTORY) + currency_code)
-
-    try:
-        with Timeout(API_CALL_TIMEOUT_THRESHOLD, CallTimeoutException):
-            csv_result = urllib2.urlopen(urllib2.Request(url=history_currency_API_24h_path, headers=API_REQUEST_HEADERS)).read()
-    except (
-            KeyError,
-            ValueError,
-            socket.error,
-            simplejson.decoder.JSONDecodeError,
-            urllib2.URLError,
-            httplib.BadStatusLine,
-            CallTimeoutException) as error:
-        logger.error("can not get history data from {0}: {1}".format(
-            history_currency_API_24h_path,
-            str(error)))
-        return DEC_PLACES
+    return rolling_averages.global_prices_24h.average(currency_code)
 
-    csvfile = StringIO.StringIO(csv_result)
-    csvreader = csv.reader(csvfile, delimiter=',')
-    price_sum = DEC_PLACES
-    index = 0
-    header_passed = False
-    for row in csvreader:
-        if not header_passed:
-            header_passed = True
-            continue
-        try:
-            price_sum = price_sum + Decimal(row[len(row)-1])
-            index = index + 1
-        except (IndexError, InvalidOperation):
-            continue
-    try:
-        average_price = (price_sum / Decimal(index)).quantize(DEC_PLACES)
-    except InvalidOperation:
-        average_price = DEC_PLACES
-
-    return average_price
 
 #calculates global average for all possible currencies
 def calculateAllGlobalAverages(calculated_average_rates, total_currency_volumes):
-    def getCurrencyCrossRate(currency_from, currency_to):
-        if currency_from == currency_to:
-            return Decimal(1)
-
-        rate_from = Decimal(fiat_currencies_list[currency_from]['rate'])
-        rate_to = Decimal(fiat_currencies_list[currency_to]['rate'])
-        return (rate_from / rate_to)
-
-    fiat_exchange_rates_url = server.API_INDEX_URL + 'fiat_data'
-    try:
-        with Timeout(API_CALL_TIMEOUT_THRESHOLD, CallTimeoutException):
-            result = urllib2.urlopen(urllib2.Request(url=fiat_exchange_rates_url, headers=API_REQUEST_HEADERS)).read()
-            fiat_currencies_list = json.loads(result)
-    except (KeyError,ValueError,socket.error,simplejson.decoder.JSONDecodeError,urllib2.URLError,httplib.BadStatusLine,CallTimeoutException):
+    if fiat_rates.cache.is_empty():
+        logger.error("fiat exchange rates not available, global averages not calculated")
         return {}, {}
 
     global_volume = DEC_PLACES
@@ -134,31 +48,23 @@ def calculateAllGlobalAverages(calculated_average_rates, total_currency_volumes)
     for currency in CURRENCY_LIST:
         global_volume_percents[currency] = (total_currency_volumes[currency] / global_volume * Decimal(100)).quantize(DEC_PLACES)
 
+    # global average in currency L is rate_L * sum(average_c * percent_c / 100 / rate_c), so the sum
+    # is calculated once per cycle and every fiat currency only needs one multiplication
+    weighted_sums = {'last': DEC_PLACES,
+                     'ask': DEC_PLACES,
+                     'bid': DEC_PLACES,
+                     }
+    for currency, currency_rate in zip(CURRENCY_LIST, fiat_rates.cache.currency_list_rates):
+        currency_weight = global_volume_percents[currency] / Decimal(100) / currency_rate
+        for key in weighted_sums:
+            weighted_sums[key] = weighted_sums[key] + calculated_average_rates[currency][key] * currency_weight
+
     global_averages = {}
-    for currency_local in fiat_currencies_list:
-        global_averages[currency_local] = {'last': DEC_PLACES,
-                                           'ask': DEC_PLACES,
-                                           'bid': DEC_PLACES,
-                                            }
-        for currency_to_convert in CURRENCY_LIST:
-            global_averages[currency_local]['last'] = ( global_averages[currency_local]['last']
-                                                + (calculated_average_rates[currency_to_convert]['last']
-                                                   * global_volume_percents[currency_to_convert] / Decimal(100)
-                                                   * getCurrencyCrossRate(currency_local, currency_to_convert) )
-                                                        )
-            global_averages[currency_local]['bid'] = ( global_averages[currency_local]['bid']
-                                                + (calculated_average_rates[currency_to_convert]['bid']
-                                                   * global_volume_percents[currency_to_convert] / Decimal(100)
-                                                   * getCurrencyCrossRate(currency_local, currency_to_convert) )
-                                                        )
-            global_averages[currency_local]['ask'] = ( global_averages[currency_local]['ask']
-                                                + (calculated_average_rates[currency_to_convert]['ask']
-                                                   * global_volume_percents[currency_to_convert] / Decimal(100)
-                                                   * getCurrencyCrossRate(currency_local, currency_to_convert) )
-                                                        )
-        global_averages[currency_local]['last'] = global_averages[currency_local]['last'].quantize(DEC_PLACES)
-        global_averages[currency_local]['bid'] = global_averages[currency_local]['bid'].quantize(DEC_PLACES)
-        global_averages[currency_local]['ask'] = global_averages[currency_local]['ask'].quantize(DEC_PLACES)
+    for currency_local, currency_local_rate in fiat_rates.cache.rates.iteritems():
+        global_averages[currency_local] = {'last': (weighted_sums['last'] * currency_local_rate).quantize(DEC_PLACES),
+                                           'ask': (weighted_sums['ask'] * currency_local_rate).quantize(DEC_PLACES),
+                                           'bid': (weighted_sums['bid'] * currency_local_rate).quantize(DEC_PLACES),
+                                           }
         currency_local_24h_avg = get24hGlobalAverage(currency_local)
         if currency_local_24h_avg > DEC_PLACES:
             global_averages[currency_local]['24h_avg'] = currency_local_24h_avg
@@ -166,17 +72,17 @@ def calculateAllGlobalAverages(calculated_average_rates, total_currency_volumes)
     return global_averages, global_volume_percents
 
 
-def calculateTotalVolumes(exchanges_rates):
+def calculateTotalVolumes(exchanges_rates, currencies=CURRENCY_LIST):
     total_currency_volumes = {}
     total_currency_volumes_ask = {}
     total_currency_volumes_bid = {}
-    for currency in CURRENCY_LIST:
+    for currency in currencies:
         total_currency_volumes[currency] = DEC_PLACES
         total_currency_volumes_ask[currency] = DEC_PLACES
         total_currency_volumes_bid[currency] = DEC_PLACES
 
     for i, rate in enumerate(exchanges_rates):
-        for currency in CURRENCY_LIST:
+        for currency in currencies:
             if currency in rate:
                 if rate[currency]['volume'] is not None and rate[currency]['volume'] > 0:
                     total_currency_volumes[currency] = total_currency_volumes[currency] + rate[currency]['volume']
@@ -189,7 +95,7 @@ def calculateTotalVolumes(exchanges_rates):
                     # del exchanges_rates[i][currency]
                     # i think we should not hide exchanges with 0 volume, it should be just zeroed, but still shown. @AlexyKot
 
-    for currency in CURRENCY_LIST:
+    for currency in currencies:
         total_currency_volumes[currency] = total_currency_volumes[currency].quantize(DEC_PLACES)
         total_currency_volumes_ask[currency] = total_currency_volumes_ask[currency].quantize(DEC_PLACES)
         total_currency_volumes_bid[currency] = total_currency_volumes_bid[currency].quantize(DEC_PLACES)
@@ -197,13 +103,14 @@ def calculateTotalVolumes(exchanges_rates):
     return total_currency_volumes, total_currency_volumes_ask, total_currency_volumes_bid
 
 
-def calculateRelativeVolumes(exchanges_rates, total_currency_volumes, total_currency_volumes_ask, total_currency_volumes_bid):
+def calculateRelativeVolumes(exchanges_rates, total_currency_volumes, total_currency_volumes_ask, total_currency_volumes_bid,
+                             currencies=CURRENCY_LIST):
     calculated_volumes = {}
-    for currency in CURRENCY_LIST:
+    for currency in currencies:
         calculated_volumes[currency] = {}
 
     for rate in exchanges_rates:
-        for currency in CURRENCY_LIST:
+        for currency in currencies:
             if currency in rate:
                 calculated_volumes[currency][rate['exchange_name']] = {}
                 calculated_volumes[currency][rate['exchange_name']]['rates'] = {'ask': rate[currency]['ask'],
@@ -248,16 +155,16 @@ def calculateRelativeVolumes(exchanges_rates, total_currency_volumes, total_curr
     return calculated_volumes
 
 
-def calculateAverageRates(exchanges_rates, calculated_volumes):
+def calculateAverageRates(exchanges_rates, calculated_volumes, currencies=CURRENCY_LIST):
     calculated_average_rates = {}
-    for currency in CURRENCY_LIST:
+    for currency in currencies:
         calculated_average_rates[currency] = {'last': DEC_PLACES,
                                                'ask': DEC_PLACES,
                                                'bid': DEC_PLACES,
                                                 }
 
     for rate in exchanges_rates:
-        for currency in CURRENCY_LIST:
+        for currency in currencies:
             if currency in rate:
                 if rate[currency]['last'] is not None:
                     calculated_average_rates[currency]['last'] = ( calculated_average_rates[currency]['last']
@@ -365,96 +272,500 @@ def formatDataForAPI(calculated_average_rates, calculated_volumes, total_currenc
     return calculated_average_rates, calculated_volumes, calculated_global_average_rates
 
 
+def _formatAPIValue(value):
+    try:
+        return float(value)
+    except TypeError:
+        return str(value)
+
+
+_exchange_ids = {}
+
+
+class ExchangeRecord(object):
+    """
+    Compact per-exchange data, built once when exchange data changes. tickers is indexed by
+    position of a currency in CURRENCY_LIST, None for currencies the exchange does not quote.
+    """
+    __slots__ = ('exchange_id', 'name', 'source', 'display_name', 'display_URL', 'tickers')
+
+
+class TickerRecord(object):
+    __slots__ = ('exchange', 'currency_id', 'last', 'ask', 'bid', 'volume')
+
+
+def createExchangeRecord(exchange_rate):
+    exchange_name = intern(str(exchange_rate['exchange_name']))
+    if exchange_name not in _exchange_ids:
+        _exchange_ids[exchange_name] = len(_exchange_ids)
+
+    exchange = ExchangeRecord()
+    exchange.exchange_id = _exchange_ids[exchange_name]
+    exchange.name = exchange_name
+    exchange.source = exchange_rate['data_source']
+    exchange.display_name = exchange_rate['exchange_display_name']
+    exchange.display_URL = exchange_rate.get('exchange_display_URL')
+    exchange.tickers = [None] * len(CURRENCY_LIST)
+    for currency_id, currency in enumerate(CURRENCY_LIST):
+        if currency in exchange_rate:
+            ticker = TickerRecord()
+            ticker.exchange = exchange
+            ticker.currency_id = currency_id
+            ticker.last = exchange_rate[currency]['last']
+            ticker.ask = exchange_rate[currency]['ask']
+            ticker.bid = exchange_rate[currency]['bid']
+            ticker.volume = exchange_rate[currency]['volume']
+            exchange.tickers[currency_id] = ticker
+    return exchange
+
+
+def calculateCurrencyForAPI(currency, ticker_records):
+    """
+    Fused equivalent of calculateTotalVolumes, calculateRelativeVolumes, calculateAverageRates and
+    formatDataForAPI for one currency, ticker_records must be in the same exchange order.
+    Returns total volume, Decimal average rates, formatted averages and formatted exchanges.
+    """
+    total_volume = DEC_PLACES
+    total_volume_ask = DEC_PLACES
+    total_volume_bid = DEC_PLACES
+    for ticker in ticker_records:
+        if ticker.volume is not None and ticker.volume > 0:
+            total_volume = total_volume + ticker.volume
+            if ticker.ask is not None:
+                total_volume_ask = total_volume_ask + ticker.volume
+            if ticker.bid is not None:
+                total_volume_bid = total_volume_bid + ticker.volume
+    total_volume = total_volume.quantize(DEC_PLACES)
+    total_volume_ask = total_volume_ask.quantize(DEC_PLACES)
+    total_volume_bid = total_volume_bid.quantize(DEC_PLACES)
+
+    average_last = DEC_PLACES
+    average_ask = DEC_PLACES
+    average_bid = DEC_PLACES
+    exchanges_formatted = {}
+    lean_schema = getattr(ba.server, 'API_LEAN_SCHEMA', False)
+    hundred = Decimal(100)
+    zero_percent = Decimal(0).quantize(DEC_PLACES)
+    for ticker in ticker_records:
+        volume = ticker.volume
+        if volume is None:
+            volume = DEC_PLACES
+
+        if total_volume > 0:
+            volume_percent = (volume / total_volume * hundred).quantize(DEC_PLACES)
+        else:
+            volume_percent = zero_percent
+
+        if ticker.last is not None:
+            average_last = average_last + ticker.last * volume_percent / hundred
+        # ask and bid volume totals usually equal the total volume, then percents are the same
+        if ticker.ask is not None:
+            if total_volume > 0 and total_volume_ask != total_volume:
+                volume_percent_ask = (volume / total_volume_ask * hundred).quantize(DEC_PLACES)
+            else:
+                volume_percent_ask = volume_percent
+            average_ask = average_ask + ticker.ask * volume_percent_ask / hundred
+        if ticker.bid is not None:
+            if total_volume > 0 and total_volume_bid != total_volume:
+                volume_percent_bid = (volume / total_volume_bid * hundred).quantize(DEC_PLACES)
+            else:
+                volume_percent_bid = volume_percent
+            average_bid = average_bid + ticker.bid * volume_percent_bid / hundred
+        average_last = average_last.quantize(DEC_PLACES)
+        average_ask = average_ask.quantize(DEC_PLACES)
+        average_bid = average_bid.quantize(DEC_PLACES)
+
+        exchange = ticker.exchange
+        exchange_formatted = {'rates': {'ask': _formatAPIValue(ticker.ask),
+                                        'bid': _formatAPIValue(ticker.bid),
+                                        'last': _formatAPIValue(ticker.last),
+                                        },
+                              'source': exchange.source,
+                              'volume_btc': float(volume.quantize(DEC_PLACES)),
+                              'volume_percent': float(volume_percent),
+                              }
+        # the lean schema leaves static exchange data to /exchanges/metadata
+        if not lean_schema:
+            exchange_formatted['display_name'] = exchange.display_name
+            if exchange.display_URL is not None:
+                exchange_formatted['display_URL'] = exchange.display_URL
+        exchanges_formatted[exchange.name] = exchange_formatted
+
+    average_rates = {'last': average_last,
+                     'ask': average_ask,
+                     'bid': average_bid,
+                     }
+    average_rates_formatted = {'last': float(average_last),
+                               'ask': float(average_ask),
+                               'bid': float(average_bid),
+                               'total_vol': float(total_volume),
+                               '24h_avg': float(get24hAverage(currency)),
+                               }
+    return total_volume, average_rates, average_rates_formatted, exchanges_formatted
+
+
+def formatGlobalAveragesForAPI(calculated_global_average_rates, total_currency_volumes, calculated_global_volume_percents):
+    calculated_global_average_rates_formatted = {}
+    for currency in calculated_global_average_rates:
+        global_average = calculated_global_average_rates[currency]
+        global_average_formatted = {'last': _formatAPIValue(global_average['last']),
+                                    'ask': _formatAPIValue(global_average['ask']),
+                                    'bid': _formatAPIValue(global_average['bid']),
+                                    }
+        if '24h_avg' in global_average:
+            global_average_formatted['24h_avg'] = _formatAPIValue(global_average['24h_avg'])
+        if currency in CURRENCY_LIST:
+            global_average_formatted['volume_btc'] = _formatAPIValue(total_currency_volumes[currency])
+            global_average_formatted['volume_percent'] = _formatAPIValue(calculated_global_volume_percents[currency])
+        else:
+            global_average_formatted['volume_btc'] = 0.0
+            global_average_formatted['volume_percent'] = 0.0
+        calculated_global_average_rates_formatted[currency] = global_average_formatted
+    return calculated_global_average_rates_formatted
+
+
 def writeAPIFiles(api_path, timestamp, calculated_average_rates_formatted, calculated_volumes_formatted,
-                  calculated_global_average_rates_formatted, exchanges_ignored):
+                  calculated_global_average_rates_formatted, exchanges_ignored, exotic_global_tickers=True):
+    # exotic_global_tickers - also write /ticker/global/<currency> of currencies not in CURRENCY_LIST,
+    # api_daemon writes them only when their publish tier is due, /ticker/global/all always has all currencies
+    # every currency block is encoded once per cycle (and only when it changed) by json_fragments,
+    # documents are assembled from the fragments, output is the same as of json.dumps on whole documents
+    fragments = json_fragments.cache
+    timestamp_fragment = json_fragments.encode(timestamp)
     try:
+        published_currencies = [currency for currency in CURRENCY_LIST
+                                if (currency in calculated_volumes_formatted
+                                    and currency in calculated_average_rates_formatted
+                                    and currency in calculated_global_average_rates_formatted)]
+
         # /all
-        all_data = {}
-        all_data['timestamp'] = timestamp
-        all_data['ignored_exchanges'] = exchanges_ignored
-        for currency in CURRENCY_LIST:
-            if (currency in calculated_volumes_formatted
-            and currency in calculated_average_rates_formatted
-            and currency in calculated_global_average_rates_formatted):
-                cur_data = {'exchanges': calculated_volumes_formatted[currency],
-                            'averages': calculated_average_rates_formatted[currency],
-                            'global_averages': calculated_global_average_rates_formatted[currency],
-                            }
-                all_data[currency] = cur_data
+        all_items = [('timestamp', timestamp_fragment),
+                     ('ignored_exchanges', json_fragments.encode(exchanges_ignored)),
+                     ]
+        for currency in published_currencies:
+            cur_fragment = json_fragments.assembleObject([
+                ('averages', fragments.object('averages/' + currency, calculated_average_rates_formatted[currency])),
+                ('exchanges', fragments.object('exchanges/' + currency, calculated_volumes_formatted[currency])),
+                ('global_averages', fragments.object('global_averages/' + currency,
+                                                     calculated_global_average_rates_formatted[currency])),
+                ])
+            all_items.append((currency, cur_fragment))
+        all_items.sort(key=lambda item: item[0])
 
         helpers.write_api_file(
             os.path.join(api_path, API_FILES['ALL_FILE']),
-            json.dumps(all_data,  indent=2, sort_keys=True, separators=(',', ': ')))
+            json_fragments.assembleObject(all_items))
 
         # /ticker/*
-        for currency in CURRENCY_LIST:
-            if (currency in calculated_volumes_formatted and currency in calculated_average_rates_formatted
-            and currency in calculated_global_average_rates_formatted):
-                ticker_cur = calculated_average_rates_formatted[currency]
-                ticker_cur['timestamp'] = timestamp
-                ticker_currency_path = os.path.join(api_path, API_FILES['TICKER_PATH'], currency)
-                helpers.write_api_file(
-                    os.path.join(ticker_currency_path, INDEX_DOCUMENT_NAME),
-                    json.dumps(ticker_cur, indent=2, sort_keys=True, separators=(',', ': ')))
-                for key in ticker_cur:
-                    helpers.write_api_file(
-                        os.path.join(ticker_currency_path, key),
-                        str(ticker_cur[key]),
-                        compress=False)
+        rates_all = {}
+        for currency in calculated_average_rates_formatted:
+            rates_all[currency] = fragments.object('averages/' + currency, calculated_average_rates_formatted[currency])
+        for currency in published_currencies:
+            ticker_cur = json_fragments.assembleObject(json_fragments.withItem(
+                fragments.objectItems('averages/' + currency, calculated_average_rates_formatted[currency]),
+                'timestamp',
+                timestamp_fragment))
+            rates_all[currency] = ticker_cur
+            ticker_currency_path = os.path.join(api_path, API_FILES['TICKER_PATH'], currency)
+            helpers.write_api_file(
+                os.path.join(ticker_currency_path, INDEX_DOCUMENT_NAME),
+                ticker_cur)
 
         # /ticker/all
-        rates_all = calculated_average_rates_formatted
-        rates_all['timestamp'] = timestamp
+        rates_all['timestamp'] = timestamp_fragment
         helpers.write_api_file(
             os.path.join(api_path, API_FILES['TICKER_PATH'], 'all'),
-            json.dumps(rates_all, indent=2, sort_keys=True, separators=(',', ': ')))
+            json_fragments.assembleObject(sorted(rates_all.items(), key=lambda item: item[0])))
 
         # /ticker/global/*
+        rates_all = {}
         for currency in calculated_global_average_rates_formatted:
-            ticker_cur = calculated_global_average_rates_formatted[currency]
-            ticker_cur['timestamp'] = timestamp
+            ticker_cur = json_fragments.assembleObject(json_fragments.withItem(
+                fragments.objectItems('global_averages/' + currency, calculated_global_average_rates_formatted[currency]),
+                'timestamp',
+                timestamp_fragment))
+            rates_all[currency] = ticker_cur
+            if not exotic_global_tickers and currency not in CURRENCY_LIST:
+                continue
             ticker_currency_path = os.path.join(api_path, API_FILES['GLOBAL_TICKER_PATH'], currency)
             helpers.write_api_file(
                 os.path.join(ticker_currency_path, INDEX_DOCUMENT_NAME),
-                json.dumps(ticker_cur, indent=2, sort_keys=True, separators=(',', ': ')))
-            for key in ticker_cur:
-                helpers.write_api_file(
-                    os.path.join(ticker_currency_path, key),
-                    str(ticker_cur[key]),
-                    compress=False)
+                ticker_cur)
 
         # /ticker/global/all
-        rates_all = calculated_global_average_rates_formatted
-        rates_all['timestamp'] = timestamp
+        rates_all['timestamp'] = timestamp_fragment
         try:
             helpers.write_api_file(
                 os.path.join(api_path, API_FILES['GLOBAL_TICKER_PATH'], 'all'),
-                json.dumps(rates_all, indent=2, sort_keys=True, separators=(',', ': ')))
+                json_fragments.assembleObject(sorted(rates_all.items(), key=lambda item: item[0])))
         except IOError as error:
             #pass on Windows if there is currency with code ALL and it will interfer with file called 'all'
             pass
 
         # /exchanges/all
-        volumes_all = calculated_volumes_formatted
-        volumes_all['timestamp'] = timestamp
+        volumes_all = {}
+        for currency in calculated_volumes_formatted:
+            volumes_all[currency] = fragments.object('exchanges/' + currency, calculated_volumes_formatted[currency])
+        volumes_all['timestamp'] = timestamp_fragment
         helpers.write_api_file(
             os.path.join(api_path, API_FILES['EXCHANGES_PATH'], 'all'),
-            json.dumps(volumes_all, indent=2, sort_keys=True, separators=(',', ': ')))
+            json_fragments.assembleObject(sorted(volumes_all.items(), key=lambda item: item[0])))
 
         # /exchanges/*
-        for currency in CURRENCY_LIST:
-            if (currency in calculated_volumes_formatted and currency in calculated_average_rates_formatted
-                and currency in calculated_global_average_rates_formatted):
-                volume_cur = calculated_volumes_formatted[currency]
-                volume_cur['timestamp'] = timestamp
-                helpers.write_api_file(
-                    os.path.join(api_path, API_FILES['EXCHANGES_PATH'], currency),
-                    json.dumps(volume_cur,  indent=2, sort_keys=True, separators=(',', ': ')))
+        for currency in published_currencies:
+            volume_cur = json_fragments.withItem(
+                fragments.objectItems('exchanges/' + currency, calculated_volumes_formatted[currency]),
+                'timestamp',
+                timestamp_fragment)
+            helpers.write_api_file(
+                os.path.join(api_path, API_FILES['EXCHANGES_PATH'], currency),
+                json_fragments.assembleObject(volume_cur))
 
         # /ignored
         helpers.write_api_file(
             os.path.join(api_path, API_FILES['IGNORED_FILE']),
-            json.dumps(exchanges_ignored,  indent=2, sort_keys=True, separators=(',', ': ')))
+            json_fragments.encode(exchanges_ignored))
+
+    except IOError as error:
+        error_text = '%s, %s ' % (sys.exc_info()[0], error)
+        logger.error(error_text)
+        raise error
+
+
+def compactAPIDocuments(timestamp, calculated_average_rates_formatted, calculated_volumes_formatted,
+                        calculated_global_average_rates_formatted, exchanges_ignored, exotic_global_tickers=True):
+    """
+    yields (path relative to the compact API root, document) with the same content as writeAPIFiles documents,
+    per currency tickers are files there (ticker/USD), not folders with index documents
+    """
+    published_currencies = [currency for currency in CURRENCY_LIST
+                            if (currency in calculated_volumes_formatted
+                                and currency in calculated_average_rates_formatted
+                                and currency in calculated_global_average_rates_formatted)]
+
+    all_data = {'timestamp': timestamp,
+                'ignored_exchanges': exchanges_ignored,
+                }
+    for currency in published_currencies:
+        all_data[currency] = {'exchanges': calculated_volumes_formatted[currency],
+                              'averages': calculated_average_rates_formatted[currency],
+                              'global_averages': calculated_global_average_rates_formatted[currency],
+                              }
+    yield API_FILES['ALL_FILE'], all_data
+
+    rates_all = dict(calculated_average_rates_formatted)
+    for currency in published_currencies:
+        ticker_cur = dict(calculated_average_rates_formatted[currency])
+        ticker_cur['timestamp'] = timestamp
+        rates_all[currency] = ticker_cur
+        yield API_FILES['TICKER_PATH'] + currency, ticker_cur
+    rates_all['timestamp'] = timestamp
+    yield API_FILES['TICKER_PATH'] + 'all', rates_all
+
+    rates_all = dict(calculated_global_average_rates_formatted)
+    for currency in calculated_global_average_rates_formatted:
+        ticker_cur = dict(calculated_global_average_rates_formatted[currency])
+        ticker_cur['timestamp'] = timestamp
+        rates_all[currency] = ticker_cur
+        if exotic_global_tickers or currency in CURRENCY_LIST:
+            yield API_FILES['GLOBAL_TICKER_PATH'] + currency, ticker_cur
+    rates_all['timestamp'] = timestamp
+    yield API_FILES['GLOBAL_TICKER_PATH'] + 'all', rates_all
+
+    volumes_all = dict(calculated_volumes_formatted)
+    volumes_all['timestamp'] = timestamp
+    yield API_FILES['EXCHANGES_PATH'] + 'all', volumes_all
+    for currency in published_currencies:
+        volume_cur = dict(calculated_volumes_formatted[currency])
+        volume_cur['timestamp'] = timestamp
+        yield API_FILES['EXCHANGES_PATH'] + currency, volume_cur
+
+    yield API_FILES['IGNORED_FILE'], exchanges_ignored
+
+
+def writeCompactAPIFiles(api_path, timestamp, calculated_average_rates_formatted, calculated_volumes_formatted,
+                         calculated_global_average_rates_formatted, exchanges_ignored, exotic_global_tickers=True):
+    """
+    writes documents of writeAPIFiles minified under /compact and, if msgpack is installed, as MessagePack
+    under /msgpack, both from the same cycle data as the pretty printed files
+    """
+    roots = [(os.path.join(api_path, API_FILES['COMPACT_PATH']),
+              # simplejson sorts keys in its C encoder, json falls back to python code for sort_keys
+              lambda document: simplejson.dumps(document, sort_keys=True, separators=(',', ':')))]
+    if msgpack is not None:
+        roots.append((os.path.join(api_path, API_FILES['MSGPACK_PATH']), msgpack.packb))
+
+    try:
+        for root_path, serialize in roots:
+            for folder in (API_FILES['TICKER_PATH'], API_FILES['GLOBAL_TICKER_PATH'], API_FILES['EXCHANGES_PATH']):
+                helpers.make_api_folder(os.path.join(root_path, folder))
+
+        for relative_path, document in compactAPIDocuments(timestamp,
+                                                           calculated_average_rates_formatted,
+                                                           calculated_volumes_formatted,
+                                                           calculated_global_average_rates_formatted,
+                                                           exchanges_ignored,
+                                                           exotic_global_tickers):
+            for root_path, serialize in roots:
+                helpers.write_api_file(os.path.join(root_path, relative_path), serialize(document))
+
+    except (IOError, OSError) as error:
+        error_text = '%s, %s ' % (sys.exc_info()[0], error)
+        logger.error(error_text)
+        raise error
+
+
+def writeDeltaAPIFiles(api_path, timestamp, generation, calculated_average_rates_formatted,
+                       calculated_volumes_formatted, calculated_global_average_rates_formatted, exchanges_ignored):
+    """
+    writes /delta/<document>/<base generation> for API_DELTA_DOCUMENTS, minified JSON with changes of the document
+    since every kept base generation, generation is the unix time of timestamp. Deltas of bases dropped
+    from the history are removed, clients asking for them get 404 and reload the full document.
+    """
+    delta_root_path = os.path.join(api_path, API_FILES['DELTA_PATH'])
+    try:
+        for relative_path, document in compactAPIDocuments(timestamp,
+                                                           calculated_average_rates_formatted,
+                                                           calculated_volumes_formatted,
+                                                           calculated_global_average_rates_formatted,
+                                                           exchanges_ignored):
+            if relative_path not in API_DELTA_DOCUMENTS:
+                continue
+            document_deltas = api_deltas.histories[relative_path]
+            delta_folder_path = os.path.join(delta_root_path, relative_path)
+            if document_deltas.generation is None:
+                # deltas left by a previous run have bases unknown to this one
+                dropped_generations = set()
+                if os.path.exists(delta_folder_path):
+                    dropped_generations = set(file_name.split('.')[0] for file_name in os.listdir(delta_folder_path)
+                                              if file_name.split('.')[0].isdigit())
+                helpers.make_api_folder(delta_folder_path)
+                document_deltas.update(generation, document)
+            else:
+                dropped_generations = document_deltas.update(generation, document)
+
+            for base_generation in dropped_generations:
+                helpers.remove_api_file(os.path.join(delta_folder_path, str(base_generation)))
+            for base_generation, delta in document_deltas.deltaDocuments(timestamp):
+                # simplejson sorts keys in its C encoder, json falls back to python code for sort_keys
+                helpers.write_api_file(os.path.join(delta_folder_path, str(base_generation)),
+                                       simplejson.dumps(delta, sort_keys=True, separators=(',', ':')))
+
+    except (IOError, OSError) as error:
+        error_text = '%s, %s ' % (sys.exc_info()[0], error)
+        logger.error(error_text)
+        raise error
+
+
+def _dataHash(document):
+    # without timestamps, which change every cycle while the data of a quiet market does not
+    if isinstance(document, dict):
+        document = dict((key, dict(value, timestamp=None) if isinstance(value, dict) and 'timestamp' in value else value)
+                        for key, value in document.iteritems() if key != 'timestamp')
+    return hashlib.md5(simplejson.dumps(document, sort_keys=True, separators=(',', ':'))).hexdigest()[:12]
+
+
+def writeVersionAPIFiles(api_path, timestamp, generation, calculated_average_rates_formatted,
+                         calculated_volumes_formatted, calculated_global_average_rates_formatted, exchanges_ignored):
+    """
+    writes the version probe <family>/version of every API_VERSION_FAMILIES family: the generation and timestamp
+    of the cycle and a hash of the data of every family document without timestamps. Pollers fetch the probe,
+    a few hundred bytes, and download a document only when its hash changed. Documents of currencies outside
+    CURRENCY_LIST are not listed, their files are written in their own publish tier.
+    """
+    versions = dict((family, {}) for family in API_VERSION_FAMILIES)
+    for relative_path, document in compactAPIDocuments(timestamp,
+                                                       calculated_average_rates_formatted,
+                                                       calculated_volumes_formatted,
+                                                       calculated_global_average_rates_formatted,
+                                                       exchanges_ignored,
+                                                       exotic_global_tickers=False):
+        family = relative_path[:relative_path.rfind('/') + 1]
+        if family in versions:
+            versions[family][relative_path] = _dataHash(document)
+
+    try:
+        for family, document_hashes in versions.iteritems():
+            version = {'generation': generation,
+                       'timestamp': timestamp,
+                       'documents': document_hashes,
+                       }
+            helpers.write_api_file(os.path.join(api_path, family, API_FILES['VERSION_FILE']),
+                                   simplejson.dumps(version, sort_keys=True, separators=(',', ':')),
+                                   compress=False)
+
+    except IOError as error:
+        error_text = '%s, %s ' % (sys.exc_info()[0], error)
+        logger.error(error_text)
+        raise error
+
+
+def writeBundleAPIFiles(api_path, timestamp, generation, calculated_average_rates_formatted,
+                        calculated_volumes_formatted, calculated_global_average_rates_formatted,
+                        exotic_global_tickers=True):
+    """
+    writes /bundle/<currency>, everything a currency page or the embed widget shows in one small document:
+    averages, exchanges, global_averages and the sparkline, [unix time, price] samples of the last
+    API_BUNDLE_SPARKLINE_SECONDS from the 24h rolling window. Blocks are assembled from the fragments
+    writeAPIFiles encoded in the same cycle, only the sparkline is encoded here. Currencies outside
+    CURRENCY_LIST have global_averages only and, like their global tickers, are written when exotic_global_tickers.
+    """
+    fragments = json_fragments.cache
+    timestamp_fragment = json_fragments.encode(timestamp)
+    sparkline_since = generation - API_BUNDLE_SPARKLINE_SECONDS
+    bundle_path = os.path.join(api_path, API_FILES['BUNDLE_PATH'])
+    try:
+        helpers.make_api_folder(bundle_path)
+
+        for currency in calculated_global_average_rates_formatted:
+            if not exotic_global_tickers and currency not in CURRENCY_LIST:
+                continue
+            bundle_items = [('global_averages', fragments.object('global_averages/' + currency,
+                                                                 calculated_global_average_rates_formatted[currency])),
+                            ('timestamp', timestamp_fragment),
+                            ]
+            if currency in CURRENCY_LIST:
+                if currency in calculated_average_rates_formatted:
+                    bundle_items.append(('averages', fragments.object('averages/' + currency,
+                                                                      calculated_average_rates_formatted[currency])))
+                if currency in calculated_volumes_formatted:
+                    bundle_items.append(('exchanges', fragments.object('exchanges/' + currency,
+                                                                       calculated_volumes_formatted[currency])))
+                sparkline = [[int(sample_timestamp), float(price)] for sample_timestamp, price
+                             in rolling_averages.prices_24h.series(currency, sparkline_since)]
+                bundle_items.append(('sparkline', json_fragments.encode(sparkline)))
+            bundle_items.sort(key=lambda item: item[0])
+            helpers.write_api_file(os.path.join(bundle_path, currency), json_fragments.assembleObject(bundle_items))
+
+    except (IOError, OSError) as error:
+        error_text = '%s, %s ' % (sys.exc_info()[0], error)
+        logger.error(error_text)
+        raise error
+
+
+def writeAPIKeyFiles(api_path, timestamp, calculated_average_rates_formatted, calculated_volumes_formatted,
+                     calculated_global_average_rates_formatted):
+    """
+    plain text file for every key of /ticker/* and /ticker/global/*, kept apart from writeAPIFiles
+    because api_daemon may defer them when a cycle is late. Files of every ticker folder are written
+    as one batch on the I/O threads of api_files, api_daemon waits for them at the end of the cycle
+    """
+    try:
+        for currency in CURRENCY_LIST:
+            if (currency in calculated_volumes_formatted and currency in calculated_average_rates_formatted
+            and currency in calculated_global_average_rates_formatted):
+                ticker_cur = dict(calculated_average_rates_formatted[currency])
+                ticker_cur['timestamp'] = timestamp
+                helpers.write_api_folder(
+                    os.path.join(api_path, API_FILES['TICKER_PATH'], currency),
+                    dict((key, str(value)) for key, value in ticker_cur.iteritems()))
+
+        for currency in calculated_global_average_rates_formatted:
+            ticker_cur = dict(calculated_global_average_rates_formatted[currency])
+            ticker_cur['timestamp'] = timestamp
+            helpers.write_api_folder(
+                os.path.join(api_path, API_FILES['GLOBAL_TICKER_PATH'], currency),
+                dict((key, str(value)) for key, value in ticker_cur.iteritems()))
 
     except IOError as error:
         error_text = '%s, %s ' % (sys.exc_info()[0], error)
@@ -1,111 +1,161 @@
 import os
-import subprocess
-import sys
-import csv
-from copy import deepcopy
-import StringIO
-from decimal import Decimal, InvalidOperation
-import simplejson
-from eventlet.green import urllib2
-from eventlet.green import httplib
-from eventlet.timeout import Timeout
-import socket
 import json
+import logging
+
+import simplejson
 
-import bitcoinaverage as ba
-import bitcoinaverage.server as server
-from bitcoinaverage.config import DEC_PLACES, FRONTEND_MAJOR_CURRENCIES, CURRENCY_LIST, API_FILES, CUSTOM_API_FILES
-from bitcoinaverage.exceptions import CallTimeoutException
+from bitcoinaverage.config import API_FILES, CUSTOM_API_FEEDS
+from bitcoinaverage import json_fragments
 import bitcoinaverage.helpers as helpers
 
+logger = logging.getLogger(__name__)
+
+# blocks of the formatted API data a feed can project, named as the fragments of json_fragments.cache
+SOURCES = ('averages', 'exchanges', 'global_averages')
+FORMATS = ('json', 'compact', 'pretty')
+
+
+class Projection(object):
+    """
+    Custom feed document compiled from its declaration: which currencies, which keys of their block and how
+    it is encoded. Encoded currency items are kept with the repr of the block they came from and encoded again
+    only when it changed; 'pretty' feeds of whole blocks reuse the fragments writeAPIFiles encoded in the same cycle.
+    """
+
+    def __init__(self, source, currencies, fields, first_field, format):
+        if source not in SOURCES:
+            raise ValueError("unknown custom feed source {0}".format(source))
+        if format not in FORMATS:
+            raise ValueError("unknown custom feed format {0}".format(format))
+        self.source = source
+        self.currencies = currencies
+        self.fields = fields
+        self.first_field = first_field
+        self.format = format
+        self.items = {}  # currency -> (repr of its source block, encoded item or None if nothing is projected)
+
+    @staticmethod
+    def key(source, currencies, fields, first_field, format):
+        return (source,
+                tuple(currencies) if currencies is not None else None,
+                tuple(fields) if fields is not None else None,
+                first_field,
+                format)
+
+    def _project(self, block):
+        if self.fields is None:
+            return block
+        projected = {}
+        for field in self.fields:
+            if field in block:
+                projected[field] = block[field]
+                if self.first_field:
+                    break
+        return projected
+
+    def _encodeItem(self, currency, projected):
+        if self.format == 'json':
+            # same as json.dumps of the whole document
+            return json.dumps(currency) + ': ' + json.dumps(projected)
+        if self.format == 'compact':
+            return json.dumps(currency) + ':' + simplejson.dumps(projected, sort_keys=True, separators=(',', ':'))
+        return json_fragments.encode(projected)
+
+    def evaluate(self, data):
+        """
+        the feed document of data, {currency: block} of the source
+        """
+        currencies = self.currencies if self.currencies is not None else data.keys()
+        items = []
+        for currency in currencies:
+            block = data.get(currency)
+            if block is None:
+                continue
+            if self.format == 'pretty' and self.fields is None:
+                items.append((currency, json_fragments.cache.object(self.source + '/' + currency, block)))
+                continue
+            block_repr = repr(block)
+            cached_item = self.items.get(currency)
+            if cached_item is None or cached_item[0] != block_repr:
+                projected = self._project(block)
+                cached_item = (block_repr, self._encodeItem(currency, projected) if len(projected) > 0 else None)
+                self.items[currency] = cached_item
+            if cached_item[1] is not None:
+                items.append((currency, cached_item[1]))
+
+        if self.format == 'json':
+            return '{' + ', '.join(item for currency, item in items) + '}'
+        items.sort(key=lambda item: item[0])
+        if self.format == 'compact':
+            return '{' + ','.join(item for currency, item in items) + '}'
+        return json_fragments.assembleObject(items)
+
+
+class CustomFeed(object):
+    __slots__ = ('name', 'file_name', 'interval', 'projection', 'last_run')
+
+    def __init__(self, name, file_name, interval, projection):
+        self.name = name
+        self.file_name = file_name
+        self.interval = interval
+        self.projection = projection
+        self.last_run = None  # cycle time the feed was last written
+
+
+class CustomFeedRegistry(object):
+    """
+    Custom partner feeds by name, compiled into projections when registered. Feeds declaring the same projection
+    share it, a cycle evaluates every due projection once and writes its document to all of their files.
+    """
+
+    def __init__(self):
+        self.feeds = {}  # feed name -> CustomFeed
+        self.projections = {}  # Projection.key() -> Projection
+
+    def register(self, name, file_name, source, fields=None, currencies=None, first_field=False, format='json',
+                 interval=0):
+        """
+        interval - seconds between rewrites of the feed, 0 - every cycle
+        """
+        projection_key = Projection.key(source, currencies, fields, first_field, format)
+        projection = self.projections.get(projection_key)
+        if projection is None:
+            projection = Projection(*projection_key)
+            self.projections[projection_key] = projection
+        self.feeds[name] = CustomFeed(name, file_name, interval, projection)
+
+    def dueFeeds(self, current_time):
+        """
+        returns {Projection: [CustomFeed]} of feeds due at current_time
+        """
+        due_feeds = {}
+        for feed in self.feeds.itervalues():
+            if feed.last_run is None or current_time - feed.last_run >= feed.interval:
+                due_feeds.setdefault(feed.projection, []).append(feed)
+        return due_feeds
+
+
+registry = CustomFeedRegistry()
+for feed_name, feed_declaration in CUSTOM_API_FEEDS.iteritems():
+    registry.register(feed_name, **feed_declaration)
+
 
 def createCustomAPIs(api_document_root,
                      human_timestamp,
+                     current_time,
                      calculated_average_rates_formatted,
                      calculated_volumes_formatted,
                      calculated_global_average_rates_formatted,
                      exchanges_ignored):
 
-    if not os.path.exists(os.path.join(api_document_root, API_FILES['CUSTOM_API'])):
-        os.makedirs(os.path.join(api_document_root, API_FILES['CUSTOM_API']))
-
-    globals_list = globals()
-    for globals_item in globals_list:
-        for custom_api_name in CUSTOM_API_FILES:
-            if globals_item == '_writeCustomAPI_{}'.format(custom_api_name):
-                globals()[globals_item](api_document_root,
-                                         CUSTOM_API_FILES[custom_api_name],
-                                         human_timestamp,
-                                         calculated_average_rates_formatted,
-                                         calculated_volumes_formatted,
-                                         calculated_global_average_rates_formatted,
-                                         exchanges_ignored)
-
-def _writeCustomAPI_AndroidBitcoinWallet(api_path, api_file_name, human_timestamp, calculated_average_rates_formatted,
-                                         calculated_volumes_formatted, calculated_global_average_rates_formatted,
-                                         exchanges_ignored):
-
-    result = {}
-    major_currencies = []
-    index = 0
-    for currency_code in CURRENCY_LIST:
-        major_currencies.append(currency_code)
-        index = index + 1
-        if index == FRONTEND_MAJOR_CURRENCIES:
-            break
-
-    for currency_code in calculated_global_average_rates_formatted:
-        if "24h_avg" in calculated_global_average_rates_formatted[currency_code]:
-            result[currency_code] = {'24h_avg': calculated_global_average_rates_formatted[currency_code]['24h_avg']}
-        elif "last" in calculated_global_average_rates_formatted[currency_code]:
-            result[currency_code] = {'last': calculated_global_average_rates_formatted[currency_code]['last']}
-
-    helpers.write_api_file(
-        os.path.join(api_path, API_FILES['CUSTOM_API'], api_file_name),
-        json.dumps(result))
-
-def _writeCustomAPI_HiveMacDesktopWallet(api_path, api_file_name, human_timestamp, calculated_average_rates_formatted,
-                                         calculated_volumes_formatted, calculated_global_average_rates_formatted,
-                                         exchanges_ignored):
-
-    result = {}
-    major_currencies = []
-    index = 0
-    for currency_code in CURRENCY_LIST:
-        major_currencies.append(currency_code)
-        index = index + 1
-        if index == FRONTEND_MAJOR_CURRENCIES:
-            break
-
-    for currency_code in calculated_global_average_rates_formatted:
-        if "24h_avg" in calculated_global_average_rates_formatted[currency_code]:
-            result[currency_code] = {'24h_avg': calculated_global_average_rates_formatted[currency_code]['24h_avg']}
-        elif "last" in calculated_global_average_rates_formatted[currency_code]:
-            result[currency_code] = {'last': calculated_global_average_rates_formatted[currency_code]['last']}
-
-    helpers.write_api_file(
-        os.path.join(api_path, API_FILES['CUSTOM_API'], api_file_name),
-        json.dumps(result))
-
-def _writeCustomAPI_HiveAndroidWallet(api_path, api_file_name, human_timestamp, calculated_average_rates_formatted,
-                                         calculated_volumes_formatted, calculated_global_average_rates_formatted,
-                                         exchanges_ignored):
-
-    result = {}
-    major_currencies = []
-    index = 0
-    for currency_code in CURRENCY_LIST:
-        major_currencies.append(currency_code)
-        index = index + 1
-        if index == FRONTEND_MAJOR_CURRENCIES:
-            break
-
-    for currency_code in calculated_global_average_rates_formatted:
-        if "24h_avg" in calculated_global_average_rates_formatted[currency_code]:
-            result[currency_code] = {'24h_avg': calculated_global_average_rates_formatted[currency_code]['24h_avg']}
-        elif "last" in calculated_global_average_rates_formatted[currency_code]:
-            result[currency_code] = {'last': calculated_global_average_rates_formatted[currency_code]['last']}
-
-    helpers.write_api_file(
-        os.path.join(api_path, API_FILES['CUSTOM_API'], api_file_name),
-        json.dumps(result))
+    helpers.make_api_folder(os.path.join(api_document_root, API_FILES['CUSTOM_API']))
+
+    sources = {'averages': calculated_average_rates_formatted,
+               'exchanges': calculated_volumes_formatted,
+               'global_averages': calculated_global_average_rates_formatted,
+               }
+    for projection, feeds in registry.dueFeeds(current_time).iteritems():
+        content = projection.evaluate(sources[projection.source])
+        for feed in feeds:
+            helpers.write_api_file(os.path.join(api_document_root, API_FILES['CUSTOM_API'], feed.file_name), content)
+            feed.last_run = current_time
@@ -0,0 +1,132 @@
+import collections
+
+from bitcoinaverage.config import API_DELTA_GENERATIONS
+
+
+def flatten(document):
+    """
+    returns ({key path tuple: leaf value}, set of key paths of nested objects), empty objects are leaves
+    """
+    leaves = {}
+    objects = set()
+    stack = [((), document)]
+    while len(stack) > 0:
+        path, value = stack.pop()
+        if isinstance(value, dict) and len(value) > 0:
+            objects.add(path)
+            for key, item in value.iteritems():
+                stack.append((path + (key,), item))
+        else:
+            leaves[path] = value
+    return leaves, objects
+
+
+def _object(objects, path):
+    document_object = objects.get(path)
+    if document_object is None:
+        document_object = {}
+        _object(objects, path[:-1])[path[-1]] = document_object
+        objects[path] = document_object
+    return document_object
+
+
+def unflatten(leaves):
+    objects = {(): {}}  # key path -> nested object, leaves of the same object find it at once
+    for path, value in leaves.iteritems():
+        _object(objects, path[:-1])[path[-1]] = value
+    return objects[()]
+
+
+class ChangeSet(object):
+    """
+    changed leaves and removed key paths turning the document of one generation into a later one,
+    clients apply removals first, then changes, so a path removed and set again later stays removed too
+    """
+    __slots__ = ('changes', 'removed')
+
+    def __init__(self, changes, removed):
+        self.changes = changes  # key path -> new value
+        self.removed = removed  # key paths removed, the shortest one when a whole object disappeared
+
+    def extend(self, change_set):
+        if len(change_set.removed) > 0:
+            # changes of removed leaves and below removed objects are gone with them
+            for changed_path in self.changes.keys():
+                for prefix_length in xrange(1, len(changed_path) + 1):
+                    if changed_path[:prefix_length] in change_set.removed:
+                        del self.changes[changed_path]
+                        break
+            self.removed.update(change_set.removed)
+        for path, value in change_set.changes.iteritems():
+            self.changes[path] = value
+            # an empty object changed before is an object with members now
+            for prefix_length in xrange(1, len(path)):
+                self.changes.pop(path[:prefix_length], None)
+
+    def document(self, base, generation, timestamp):
+        return {'base': base,
+                'generation': generation,
+                'timestamp': timestamp,
+                'changes': unflatten(self.changes),
+                'removed': [list(path) for path in sorted(self.removed)],
+                }
+
+
+class DocumentDeltas(object):
+    """
+    Bounded history of one API document for the delta API. Every cycle is a generation, numbered by the
+    unix time of the document timestamp. For each of the API_DELTA_GENERATIONS previous generations it keeps
+    the cumulated change set from that generation to the current one, so clients polling every cycle
+    or a few cycles late download only what changed. Older bases get no delta, clients reload the full document.
+    """
+
+    def __init__(self, generations=API_DELTA_GENERATIONS):
+        self.generation = None
+        self.leaves = None
+        self.objects = None
+        self.change_sets = collections.OrderedDict()  # base generation -> ChangeSet from it to self.generation
+        self.generations = generations
+
+    def update(self, generation, document):
+        """
+        returns base generations dropped from the history
+        """
+        leaves, objects = flatten(document)
+        dropped_generations = []
+        if self.leaves is not None and generation > self.generation:
+            changes = dict((path, value) for path, value in leaves.iteritems()
+                           if path not in self.leaves or self.leaves[path] != value)
+            removed = set()
+            for path in self.leaves:
+                if path in leaves:
+                    continue
+                # shortest prefix missing in the new document, whole objects are removed at once
+                for prefix_length in xrange(1, len(path) + 1):
+                    prefix = path[:prefix_length]
+                    if prefix not in objects and prefix not in leaves:
+                        removed.add(prefix)
+                        break
+            change_set = ChangeSet(changes, removed)
+            for base_change_set in self.change_sets.itervalues():
+                base_change_set.extend(change_set)
+            self.change_sets[self.generation] = ChangeSet(dict(changes), set(removed))
+            while len(self.change_sets) > self.generations:
+                dropped_generations.append(self.change_sets.popitem(last=False)[0])
+        elif self.leaves is not None:
+            # same or earlier generation, the clock went back, the history would lie
+            dropped_generations = self.change_sets.keys()
+            self.change_sets.clear()
+        self.generation = generation
+        self.leaves = leaves
+        self.objects = objects
+        return dropped_generations
+
+    def deltaDocuments(self, timestamp):
+        """
+        yields (base generation, delta document) for all kept base generations
+        """
+        for base, change_set in self.change_sets.iteritems():
+            yield base, change_set.document(base, self.generation, timestamp)
+
+
+histories = collections.defaultdict(DocumentDeltas)  # API document path -> DocumentDeltas
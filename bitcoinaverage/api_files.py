@@ -0,0 +1,342 @@
+import os
+import gzip
+import hashlib
+import logging
+import StringIO
+from multiprocessing.pool import ThreadPool
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+import bitcoinaverage as ba
+from bitcoinaverage.config import (API_FILES, API_GZIP_LEVELS, API_COMPRESS_WORKERS, API_BROTLI_FILES,
+                                   API_BROTLI_QUALITY, API_IO_WORKERS)
+
+logger = logging.getLogger(__name__)
+
+if brotli is None and len(API_BROTLI_FILES) > 0:
+    logger.warning("brotli module is not installed, .br API files are not written")
+
+
+def gzipContent(content, level):
+    # mtime is fixed, so the same content always gives the same bytes
+    gzipped_buffer = StringIO.StringIO()
+    gzipped_file = gzip.GzipFile(filename='', mode='wb', compresslevel=level, fileobj=gzipped_buffer, mtime=0)
+    gzipped_file.write(content)
+    gzipped_file.close()
+    return gzipped_buffer.getvalue()
+
+
+def _countSyscalls(syscalls, *names):
+    for name in names:
+        syscalls[name] = syscalls.get(name, 0) + 1
+
+
+def _replaceFile(file_name, content, syscalls):
+    with open(file_name + '.tmp', 'wb') as tmp_file:
+        tmp_file.write(content)
+    os.rename(file_name + '.tmp', file_name)
+    _countSyscalls(syscalls, 'open', 'write', 'close', 'rename')
+
+
+def _writeCompressed(api_file_name, content, level, write_brotli):
+    """
+    returns sizes of the written encodings and counts of the syscalls made
+    """
+    syscalls = {}
+    gzipped_content = gzipContent(content, level)
+    _replaceFile(api_file_name + '.gz', gzipped_content, syscalls)
+    sizes = {'identity': len(content), 'gzip': len(gzipped_content)}
+    if write_brotli:
+        brotli_content = brotli.compress(content, quality=API_BROTLI_QUALITY)
+        _replaceFile(api_file_name + '.br', brotli_content, syscalls)
+        sizes['br'] = len(brotli_content)
+    return sizes, syscalls
+
+
+def _writeFolder(folder_path, contents):
+    """
+    writes [(file name, content)] of one folder, returns counts of the syscalls made
+    """
+    syscalls = {}
+    for file_name, content in contents:
+        _replaceFile(os.path.join(folder_path, file_name), content, syscalls)
+    return syscalls
+
+
+def endpointClass(api_file_name):
+    if os.path.basename(api_file_name) == API_FILES['ALL_FILE']:
+        return 'all'
+    if api_file_name.startswith(os.path.join(ba.server.HISTORY_DOCUMENT_ROOT, '')):
+        return 'history'
+    relative_path = os.path.relpath(api_file_name, ba.server.API_DOCUMENT_ROOT)
+    for endpoint_class, path in (('custom', API_FILES['CUSTOM_API']),
+                                 ('ticker', API_FILES['TICKER_PATH']),
+                                 ('exchanges', API_FILES['EXCHANGES_PATH'])):
+        if relative_path.startswith(path):
+            return endpoint_class
+    return '_default'
+
+
+def contentType(api_file_name):
+    relative_path = os.path.relpath(api_file_name, ba.server.API_DOCUMENT_ROOT)
+    if relative_path.startswith(API_FILES['MSGPACK_PATH']):
+        return 'application/x-msgpack'
+    if relative_path.endswith('.ico'):
+        return 'image/x-icon'
+    return 'application/json'
+
+
+class APIFileWriter(object):
+    """
+    Writes API files atomically (temporary file and rename), so nginx never serves a half written document.
+    Keeps a hash of the last content written to every file and does not touch files whose content did not change.
+    .gz siblings (and .br for API_BROTLI_FILES) are compressed from memory on API_COMPRESS_WORKERS threads,
+    zlib and brotli release the GIL; flush() waits for them. Unchanged files are skipped before compression,
+    so they are never recompressed.
+    Folders of small uncompressed files (the per key ticker files) are written by writeFolder() as one batch
+    per folder on API_IO_WORKERS threads, off the daemon thread. flush() is the end of cycle barrier for both.
+    With a store set (api_server.APIDocumentStore) documents under API_DOCUMENT_ROOT are kept in memory
+    instead of files, compressed on the same threads, and flush() publishes them.
+    """
+
+    def __init__(self):
+        # files are keyed by path relative to API_DOCUMENT_ROOT, which moves to a new folder every cycle
+        # when API snapshots are enabled (see api_snapshots.py), other files by absolute path
+        self.content_hashes = {}  # file key -> md5 of the content last written there
+        self.gzip_levels = {}  # file key -> gzip level of its endpoint class
+        self.pending = {}  # file path -> (file key, .br written, compression result not waited for yet)
+        self.pending_folders = {}  # folder path -> ([(file key, content hash)], batch result not waited for yet)
+        self.brotli_files = frozenset(API_BROTLI_FILES) if brotli is not None else frozenset()
+        self.encoded_sizes = {}  # file key -> {encoding: bytes} of the last written .br files
+        self.store = None
+        self.generation = None  # unix time of the cycle being written, published with stored documents
+        self.pool = None
+        self.io_pool = None
+        self.written_count = 0
+        self.skipped_count = 0
+        self.syscalls = {}  # syscall name -> count since the previous takeSyscallCounts()
+
+    def _fileKey(self, api_file_name):
+        api_document_root = os.path.join(ba.server.API_DOCUMENT_ROOT, '')
+        if api_file_name.startswith(api_document_root):
+            return api_file_name[len(api_document_root):]
+        return api_file_name
+
+    def write(self, api_file_name, content, compress=True):
+        file_key = self._fileKey(api_file_name)
+        in_store = self._inStore(api_file_name, file_key)
+        content_hash = hashlib.md5(content).digest()
+        if self.content_hashes.get(file_key) == content_hash:
+            if in_store:
+                exists = self.store.has(file_key)
+            else:
+                _countSyscalls(self.syscalls, 'stat')
+                exists = os.path.exists(api_file_name)
+            if exists:
+                self.skipped_count = self.skipped_count + 1
+                return False
+
+        if api_file_name in self.pending:
+            self._wait(api_file_name)
+        # forget the hash first, a failed write must not be skipped next time
+        self.content_hashes.pop(file_key, None)
+        if in_store:
+            self._compress(api_file_name, file_key, content, compress, in_store)
+        else:
+            _replaceFile(api_file_name, content, self.syscalls)
+            if compress:
+                self._compress(api_file_name, file_key, content, compress, in_store)
+        self.content_hashes[file_key] = content_hash
+        self.written_count = self.written_count + 1
+        return True
+
+    def remove(self, api_file_name):
+        """
+        removes an API file with its compressed siblings
+        """
+        file_key = self._fileKey(api_file_name)
+        if api_file_name in self.pending:
+            self._wait(api_file_name)
+        self.content_hashes.pop(file_key, None)
+        self.encoded_sizes.pop(file_key, None)
+        if self._inStore(api_file_name, file_key):
+            self.store.remove(file_key)
+            return
+        for suffix in ('', '.gz', '.br'):
+            try:
+                os.remove(api_file_name + suffix)
+            except OSError:
+                pass
+            _countSyscalls(self.syscalls, 'unlink')
+
+    def makeFolder(self, folder_path):
+        """
+        creates a folder for API files if missing, not needed when its documents are kept in the store
+        """
+        if self._inStore(folder_path, self._fileKey(os.path.join(folder_path, ''))):
+            return
+        _countSyscalls(self.syscalls, 'stat')
+        if not os.path.exists(folder_path):
+            os.makedirs(folder_path)
+
+    def _inStore(self, api_file_name, file_key):
+        return self.store is not None and file_key != api_file_name
+
+    def _compress(self, api_file_name, file_key, content, compress, in_store):
+        level = None
+        write_brotli = False
+        if compress:
+            level = self.gzip_levels.get(file_key)
+            if level is None:
+                level = API_GZIP_LEVELS.get(endpointClass(api_file_name), API_GZIP_LEVELS['_default'])
+                self.gzip_levels[file_key] = level
+            write_brotli = file_key in self.brotli_files
+
+        if in_store:
+            compress_function = self.store.put
+            arguments = (file_key, content, contentType(api_file_name), level, write_brotli)
+        else:
+            compress_function = _writeCompressed
+            arguments = (api_file_name, content, level, write_brotli)
+        if API_COMPRESS_WORKERS <= 0:
+            self._compressed(file_key, write_brotli, *compress_function(*arguments))
+            return
+        if self.pool is None:
+            self.pool = ThreadPool(API_COMPRESS_WORKERS)
+        self.pending[api_file_name] = (file_key, write_brotli, self.pool.apply_async(compress_function, arguments))
+
+    def _compressed(self, file_key, write_brotli, sizes, syscalls):
+        if write_brotli:
+            self.encoded_sizes[file_key] = sizes
+        self._addSyscalls(syscalls)
+
+    def _addSyscalls(self, syscalls):
+        for name, count in syscalls.iteritems():
+            self.syscalls[name] = self.syscalls.get(name, 0) + count
+
+    def _wait(self, api_file_name):
+        file_key, write_brotli, result = self.pending.pop(api_file_name)
+        try:
+            self._compressed(file_key, write_brotli, *result.get())
+        except (IOError, OSError) as error:
+            self.content_hashes.pop(file_key, None)
+            logger.error("can not write compressed {0}: {1}".format(api_file_name, str(error)))
+            raise
+
+    def writeFolder(self, folder_path, contents):
+        """
+        writes {file name: content} uncompressed into existing folder_path, files whose content did not change
+        are skipped, one listdir of the folder replaces a stat of every unchanged file
+        """
+        if folder_path in self.pending_folders:
+            self._waitFolder(folder_path)
+
+        changed_files = []
+        unchanged_files = []
+        in_store = False
+        for file_name, content in contents.iteritems():
+            api_file_name = os.path.join(folder_path, file_name)
+            file_key = self._fileKey(api_file_name)
+            in_store = self._inStore(api_file_name, file_key)
+            content_hash = hashlib.md5(content).digest()
+            if self.content_hashes.get(file_key) == content_hash and (not in_store or self.store.has(file_key)):
+                unchanged_files.append((file_name, content, file_key, content_hash))
+            else:
+                changed_files.append((file_name, content, file_key, content_hash))
+
+        if in_store:
+            # a few bytes each, not worth compressing or handing to a thread
+            self.skipped_count = self.skipped_count + len(unchanged_files)
+            for file_name, content, file_key, content_hash in changed_files:
+                self.store.put(file_key, content, 'text/plain', None, False)
+                self.content_hashes[file_key] = content_hash
+            self.written_count = self.written_count + len(changed_files)
+            return len(changed_files)
+
+        if len(unchanged_files) > 0:
+            _countSyscalls(self.syscalls, 'listdir')
+            try:
+                existing_file_names = frozenset(os.listdir(folder_path))
+            except OSError:
+                existing_file_names = frozenset()
+            for unchanged_file in unchanged_files:
+                if unchanged_file[0] in existing_file_names:
+                    self.skipped_count = self.skipped_count + 1
+                else:
+                    changed_files.append(unchanged_file)
+
+        if len(changed_files) == 0:
+            return 0
+
+        # forget the hashes first, a failed batch must not be skipped next time
+        for file_name, content, file_key, content_hash in changed_files:
+            self.content_hashes.pop(file_key, None)
+        file_hashes = [(file_key, content_hash) for file_name, content, file_key, content_hash in changed_files]
+        batch = [(file_name, content) for file_name, content, file_key, content_hash in changed_files]
+        if API_IO_WORKERS <= 0:
+            self._folderWritten(file_hashes, _writeFolder(folder_path, batch))
+            return len(changed_files)
+        if self.io_pool is None:
+            self.io_pool = ThreadPool(API_IO_WORKERS)
+        self.pending_folders[folder_path] = (file_hashes, self.io_pool.apply_async(_writeFolder, (folder_path, batch)))
+        return len(changed_files)
+
+    def _folderWritten(self, file_hashes, syscalls):
+        for file_key, content_hash in file_hashes:
+            self.content_hashes[file_key] = content_hash
+        self.written_count = self.written_count + len(file_hashes)
+        self._addSyscalls(syscalls)
+
+    def _waitFolder(self, folder_path):
+        file_hashes, result = self.pending_folders.pop(folder_path)
+        try:
+            self._folderWritten(file_hashes, result.get())
+        except (IOError, OSError) as error:
+            logger.error("can not write API files of {0}: {1}".format(folder_path, str(error)))
+            raise
+
+    def flush(self):
+        """
+        waits until all compressed files and folder batches are written and publishes stored documents,
+        raises the first write error
+        """
+        first_error = None
+        for wait, pending in ((self._waitFolder, self.pending_folders), (self._wait, self.pending)):
+            for pending_path in pending.keys():
+                try:
+                    wait(pending_path)
+                except (IOError, OSError) as error:
+                    if first_error is None:
+                        first_error = error
+        if first_error is not None:
+            raise first_error
+        if self.store is not None:
+            self.store.publish(self.generation)
+
+    def encodingSavings(self):
+        """
+        returns {path relative to API_DOCUMENT_ROOT: {encoding: bytes}} of files written as .br
+        """
+        return dict(self.encoded_sizes)
+
+    def takeCounts(self):
+        """
+        returns (written, skipped) files since the previous call
+        """
+        counts = (self.written_count, self.skipped_count)
+        self.written_count = 0
+        self.skipped_count = 0
+        return counts
+
+    def takeSyscallCounts(self):
+        """
+        returns {syscall name: count} made writing API files since the previous call
+        """
+        syscalls = self.syscalls
+        self.syscalls = {}
+        return syscalls
+
+
+writer = APIFileWriter()
@@ -0,0 +1,235 @@
+import time
+from email import utils
+import logging
+
+from bitcoinaverage import api_custom_writers
+from bitcoinaverage import api_files
+from bitcoinaverage import helpers
+from bitcoinaverage import tracing
+from bitcoinaverage.config import API_WRITE_FREQUENCY, API_CYCLE_BUDGET, API_STAGE_MAX_DEFERRALS, API_PUBLISH_TIERS
+from bitcoinaverage.api_calculations import (writeAPIFiles, writeCompactAPIFiles, writeDeltaAPIFiles,
+                                             writeVersionAPIFiles, writeBundleAPIFiles, writeAPIKeyFiles)
+from bitcoinaverage.incremental_calculations import ExchangesTracker, IncrementalCalculator
+
+logger = logging.getLogger(__name__)
+
+STAGE_PRIORITY_CORE = 0  # runs every cycle
+STAGE_PRIORITY_LOW = 1  # deferred when the cycle spent API_CYCLE_BUDGET
+
+
+class APIPipeline(object):
+    """
+    Calculations and API writers of one api_daemon cycle, driven by raw redis data so the same
+    code runs in the daemon and in replay_api_cycles.py
+    """
+
+    # stage name, priority, publish tier (API_PUBLISH_TIERS) setting minimal seconds between runs
+    STAGES = (('decode', STAGE_PRIORITY_CORE, 'core'),
+              ('calculate', STAGE_PRIORITY_CORE, 'core'),
+              ('write_api_files', STAGE_PRIORITY_CORE, 'core'),
+              ('write_compact_api_files', STAGE_PRIORITY_CORE, 'core'),
+              ('write_bundle_api_files', STAGE_PRIORITY_CORE, 'core'),
+              ('write_delta_api_files', STAGE_PRIORITY_CORE, 'core'),
+              ('write_version_api_files', STAGE_PRIORITY_CORE, 'core'),
+              ('write_api_key_files', STAGE_PRIORITY_LOW, 'key_files'),
+              ('write_custom_apis', STAGE_PRIORITY_LOW, 'custom'),
+              ('write_sitemap', STAGE_PRIORITY_LOW, 'sitemap'),
+              )
+
+    def __init__(self, api_document_root):
+        self.api_document_root = api_document_root
+        self.exchanges_tracker = ExchangesTracker()
+        self.calculator = IncrementalCalculator()
+        self.stage_timings = {}  # seconds spent in every stage during the last cycle
+        self.deferred_stages = []  # low priority stages deferred during the last cycle
+        self.files_written = 0  # API files written during the last cycle
+        self.files_skipped = 0  # API files not written during the last cycle because their content did not change
+        self.cycle_seconds = 0  # wall time of the last cycle
+        self.syscalls = {}  # syscalls made writing API files during the last cycle
+        self.current_time = 0  # time of the data of the cycle being run
+        self.tier_last_run = {}  # publish tier -> current_time of the cycle which last wrote it
+        self.stage_deferrals = {}  # cycles in a row every stage was deferred
+        self.metrics = {'cycles': 0,
+                        'overruns': 0,
+                        'files_written': 0,
+                        'files_skipped': 0,
+                        'syscalls': {},
+                        'deferred': dict((stage_name, 0) for stage_name, priority, tier in self.STAGES),
+                        'forced': dict((stage_name, 0) for stage_name, priority, tier in self.STAGES),
+                        }
+
+    def run_cycle(self, raw_exchanges, exchanges_ignored, current_time, cycle_start_time=None):
+        """
+        cycle_start_time is when the daemon started the cycle (before reading redis),
+        the budget is counted from it
+        """
+        if cycle_start_time is None:
+            cycle_start_time = time.time()
+        self.stage_timings = {}
+        self.deferred_stages = []
+        self.current_time = current_time
+        api_files.writer.generation = int(current_time)
+        api_files.writer.takeCounts()
+        human_timestamp = utils.formatdate(current_time)
+
+        with tracing.span('decode') as stage:
+            dirty_currencies = self.exchanges_tracker.update(raw_exchanges)
+        self._stageDone(stage)
+
+        with tracing.span('calculate') as stage:
+            (calculated_average_rates_formatted,
+             calculated_volumes_formatted,
+             calculated_global_average_rates_formatted) = self.calculator.update(
+                self.exchanges_tracker.exchangeRecords(raw_exchanges),
+                dirty_currencies,
+                int(current_time))
+        self._stageDone(stage)
+
+        # global tickers of currencies outside CURRENCY_LIST are written by the core stages, in their own tier
+        exotic_global_tickers = self._tierDue('global_tickers')
+        with tracing.span('write_api_files') as stage:
+            writeAPIFiles(self.api_document_root,
+                          human_timestamp,
+                          calculated_average_rates_formatted,
+                          calculated_volumes_formatted,
+                          calculated_global_average_rates_formatted,
+                          exchanges_ignored,
+                          exotic_global_tickers)
+        self._stageDone(stage)
+
+        with tracing.span('write_compact_api_files') as stage:
+            writeCompactAPIFiles(self.api_document_root,
+                                 human_timestamp,
+                                 calculated_average_rates_formatted,
+                                 calculated_volumes_formatted,
+                                 calculated_global_average_rates_formatted,
+                                 exchanges_ignored,
+                                 exotic_global_tickers)
+        self._stageDone(stage)
+
+        with tracing.span('write_bundle_api_files') as stage:
+            writeBundleAPIFiles(self.api_document_root,
+                                human_timestamp,
+                                int(current_time),
+                                calculated_average_rates_formatted,
+                                calculated_volumes_formatted,
+                                calculated_global_average_rates_formatted,
+                                exotic_global_tickers)
+        self._stageDone(stage)
+        if exotic_global_tickers:
+            self.tier_last_run['global_tickers'] = current_time
+
+        with tracing.span('write_delta_api_files') as stage:
+            writeDeltaAPIFiles(self.api_document_root,
+                               human_timestamp,
+                               int(current_time),
+                               calculated_average_rates_formatted,
+                               calculated_volumes_formatted,
+                               calculated_global_average_rates_formatted,
+                               exchanges_ignored)
+        self._stageDone(stage)
+
+        with tracing.span('write_version_api_files') as stage:
+            writeVersionAPIFiles(self.api_document_root,
+                                 human_timestamp,
+                                 int(current_time),
+                                 calculated_average_rates_formatted,
+                                 calculated_volumes_formatted,
+                                 calculated_global_average_rates_formatted,
+                                 exchanges_ignored)
+        self._stageDone(stage)
+
+        if self._stageAllowed('write_api_key_files', cycle_start_time):
+            with tracing.span('write_api_key_files') as stage:
+                writeAPIKeyFiles(self.api_document_root,
+                                 human_timestamp,
+                                 calculated_average_rates_formatted,
+                                 calculated_volumes_formatted,
+                                 calculated_global_average_rates_formatted)
+            self._stageDone(stage)
+
+        if self._stageAllowed('write_custom_apis', cycle_start_time):
+            with tracing.span('write_custom_apis') as stage:
+                api_custom_writers.createCustomAPIs(self.api_document_root,
+                                                    human_timestamp,
+                                                    current_time,
+                                                    calculated_average_rates_formatted,
+                                                    calculated_volumes_formatted,
+                                                    calculated_global_average_rates_formatted,
+                                                    exchanges_ignored)
+            self._stageDone(stage)
+
+        if self._stageAllowed('write_sitemap', cycle_start_time):
+            with tracing.span('write_sitemap') as stage:
+                helpers.write_sitemap()
+            self._stageDone(stage)
+
+        # barrier, compressed files and per key file batches of this cycle are all written after it
+        with tracing.span('flush_api_files'):
+            api_files.writer.flush()
+        self.files_written, self.files_skipped = api_files.writer.takeCounts()
+        self.syscalls = api_files.writer.takeSyscallCounts()
+        for name, count in self.syscalls.iteritems():
+            self.metrics['syscalls'][name] = self.metrics['syscalls'].get(name, 0) + count
+        self.metrics['files_written'] = self.metrics['files_written'] + self.files_written
+        self.metrics['files_skipped'] = self.metrics['files_skipped'] + self.files_skipped
+        self.metrics['cycles'] = self.metrics['cycles'] + 1
+        self.cycle_seconds = time.time() - cycle_start_time
+        if self.cycle_seconds > API_WRITE_FREQUENCY:
+            self.metrics['overruns'] = self.metrics['overruns'] + 1
+            logger.warning("cycle overrun, {0} overruns in {1} cycles".format(self.metrics['overruns'],
+                                                                              self.metrics['cycles']))
+        if len(self.deferred_stages) > 0:
+            logger.warning("deferred stages: {0}".format(', '.join(self.deferred_stages)))
+
+        return human_timestamp
+
+    def _tierDue(self, tier):
+        # cycle data time, not wall time, so replay_api_cycles.py publishes tiers as the daemon did
+        return self.current_time - self.tier_last_run.get(tier, 0) >= API_PUBLISH_TIERS[tier]
+
+    def _stageAllowed(self, stage_name, cycle_start_time):
+        for name, priority, tier in self.STAGES:
+            if name == stage_name:
+                break
+        if not self._tierDue(tier):
+            return False
+        if priority == STAGE_PRIORITY_CORE or time.time() - cycle_start_time < API_CYCLE_BUDGET:
+            return True
+
+        if self.stage_deferrals.get(stage_name, 0) < API_STAGE_MAX_DEFERRALS:
+            self.stage_deferrals[stage_name] = self.stage_deferrals.get(stage_name, 0) + 1
+            self.metrics['deferred'][stage_name] = self.metrics['deferred'][stage_name] + 1
+            self.deferred_stages.append(stage_name)
+            return False
+        # deferred too many times in a row, stale files are worse than a late cycle
+        self.metrics['forced'][stage_name] = self.metrics['forced'][stage_name] + 1
+        return True
+
+    def _stageDone(self, stage):
+        self.stage_timings[stage.name] = stage.seconds
+        self.stage_deferrals[stage.name] = 0
+        for name, priority, tier in self.STAGES:
+            if name == stage.name:
+                self.tier_last_run[tier] = self.current_time
+
+    def reportMetrics(self):
+        tracing.tracer.setValue('ba_api_cycles_total', self.metrics['cycles'], 'counter')
+        tracing.tracer.setValue('ba_api_cycle_overruns_total', self.metrics['overruns'], 'counter')
+        tracing.tracer.setValue('ba_api_files_written_total', self.metrics['files_written'], 'counter')
+        tracing.tracer.setValue('ba_api_files_skipped_total', self.metrics['files_skipped'], 'counter')
+        tracing.tracer.setValue('ba_api_files_written', self.files_written)
+        tracing.tracer.setValue('ba_api_files_skipped', self.files_skipped)
+        tracing.tracer.setValue('ba_api_cycle_seconds', self.cycle_seconds)
+        for name, count in self.metrics['syscalls'].iteritems():
+            tracing.tracer.setValue('ba_api_file_syscalls_total', count, 'counter', call=name)
+        for api_file_name, sizes in api_files.writer.encodingSavings().iteritems():
+            for encoding, size in sizes.iteritems():
+                tracing.tracer.setValue('ba_api_file_bytes', size, file=api_file_name, encoding=encoding)
+        for stage_name, priority, tier in self.STAGES:
+            if priority == STAGE_PRIORITY_CORE:
+                continue
+            tracing.tracer.setValue('ba_api_stage_deferred_total', self.metrics['deferred'][stage_name], 'counter',
+                                    stage=stage_name)
+            tracing.tracer.setValue('ba_api_stage_forced_total', self.metrics['forced'][stage_name], 'counter',
+                                    stage=stage_name)
@@ -0,0 +1,286 @@
+import os
+import time
+import urllib
+import hashlib
+import logging
+import resource
+import threading
+from email import utils
+
+import eventlet
+import eventlet.wsgi
+
+import bitcoinaverage as ba
+from bitcoinaverage import api_files
+from bitcoinaverage.api_stream import StreamHub
+from bitcoinaverage.config import (INDEX_DOCUMENT_NAME, API_FILES, API_GZIP_LEVELS, API_BROTLI_QUALITY,
+                                   API_SERVER_CACHE_CONTROL, API_SERVER_STATIC_CACHE_CONTROL, API_STREAM_PATH,
+                                   API_STREAM_MAX_CONNECTIONS)
+
+logger = logging.getLogger(__name__)
+
+HISTORY_PATH = 'history/'
+# written once at startup, long cacheable
+STATIC_DOCUMENTS = frozenset([API_FILES['EXCHANGES_PATH'] + API_FILES['EXCHANGES_METADATA_FILE']])
+
+
+class APIDocument(object):
+    """
+    one API document with its precompressed variants, encoding -> (body, strong ETag)
+    """
+    __slots__ = ('content_type', 'last_modified', 'variants')
+
+    def __init__(self, content, content_type, gzip_level, write_brotli):
+        etag = hashlib.md5(content).hexdigest()
+        self.content_type = content_type
+        self.last_modified = utils.formatdate(time.time(), usegmt=True)
+        self.variants = {'identity': (content, '"{0}"'.format(etag))}
+        if gzip_level is not None:
+            self.variants['gzip'] = (api_files.gzipContent(content, gzip_level), '"{0}-gzip"'.format(etag))
+        if write_brotli:
+            self.variants['br'] = (api_files.brotli.compress(content, quality=API_BROTLI_QUALITY),
+                                   '"{0}-br"'.format(etag))
+
+    def sizes(self):
+        return dict((encoding, len(body)) for encoding, (body, etag) in self.variants.iteritems())
+
+
+class APIDocumentStore(object):
+    """
+    Latest API documents kept in memory by path relative to API_DOCUMENT_ROOT, filled by api_files.writer
+    instead of files when api_daemon runs with API_SERVER_ADDRESS. Documents put during a cycle are staged
+    and published together by publish(), so the server never mixes documents of two cycles.
+    """
+
+    def __init__(self):
+        self.published = (None, {})  # (generation, path -> APIDocument), replaced as a whole by publish()
+        self.staged = {}  # path -> APIDocument put since the last publish(), None if removed
+        self.lock = threading.Lock()
+        self.listeners = []  # called after every publish
+        self.stats = {'requests': 0, 'not_modified': 0, 'not_found': 0}
+
+    def put(self, path, content, content_type, gzip_level, write_brotli):
+        """
+        compresses and stages a document, may run on writer threads, returns (sizes of the variants, syscalls)
+        """
+        document = APIDocument(content, content_type, gzip_level, write_brotli)
+        with self.lock:
+            self.staged[path] = document
+        return document.sizes(), {}
+
+    def remove(self, path):
+        with self.lock:
+            self.staged[path] = None
+
+    def has(self, path):
+        with self.lock:
+            if path in self.staged:
+                return self.staged[path] is not None
+            return path in self.published[1]
+
+    def publish(self, generation=None):
+        """
+        generation - unix time of the cycle the staged documents were calculated in, if known
+        """
+        with self.lock:
+            if len(self.staged) == 0:
+                return
+            published_generation, documents = self.published
+            documents = dict(documents)
+            for path, document in self.staged.iteritems():
+                if document is None:
+                    documents.pop(path, None)
+                else:
+                    documents[path] = document
+            self.staged = {}
+            # a single reference swap, requests being served keep the previous dict
+            self.published = (generation if generation is not None else published_generation, documents)
+        for listener in self.listeners:
+            listener()
+
+    def get(self, path):
+        return self.published[1].get(path)
+
+
+store = APIDocumentStore()
+stream_hub = StreamHub(store)
+
+
+class HistoryFiles(object):
+    """
+    history is written to HISTORY_DOCUMENT_ROOT by history_daemon, a separate process, its files are read
+    from disk and kept as documents until their size or mtime changes
+    """
+
+    def __init__(self):
+        self.documents = {}  # path -> ((mtime, size), APIDocument)
+
+    def get(self, path):
+        file_path = os.path.join(ba.server.HISTORY_DOCUMENT_ROOT, path[len(HISTORY_PATH):])
+        try:
+            file_stat = os.stat(file_path)
+        except OSError:
+            return None
+        if not os.path.isfile(file_path):
+            return None
+        version = (file_stat.st_mtime, file_stat.st_size)
+        cached = self.documents.get(path)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        try:
+            with open(file_path, 'rb') as history_file:
+                content = history_file.read()
+        except IOError:
+            return None
+        content_type = 'text/csv' if path.endswith('.csv') else 'application/json'
+        document = APIDocument(content, content_type, API_GZIP_LEVELS['history'], False)
+        self.documents[path] = (version, document)
+        return document
+
+
+history_files = HistoryFiles()
+
+
+def _acceptedEncodings(accept_encoding):
+    accepted = set()
+    for coding in accept_encoding.split(','):
+        parts = coding.strip().split(';')
+        quality = 1.0
+        for parameter in parts[1:]:
+            name, _, value = parameter.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.add(parts[0].strip().lower())
+    return accepted
+
+
+def _etagMatches(if_none_match, etag):
+    if if_none_match.strip() == '*':
+        return True
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        # weak comparison, as RFC 7232 requires for If-None-Match
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def _findDocument(path):
+    if path == '' or path.endswith('/'):
+        path = path + INDEX_DOCUMENT_NAME
+    document = store.get(path)
+    if document is None and path.startswith(HISTORY_PATH):
+        document = history_files.get(path)
+    return document
+
+
+def application(environ, start_response):
+    store.stats['requests'] = store.stats['requests'] + 1
+    method = environ['REQUEST_METHOD']
+    if method not in ('GET', 'HEAD'):
+        start_response('405 Method Not Allowed', [('Allow', 'GET, HEAD'), ('Content-Length', '0')])
+        return []
+
+    path = urllib.unquote(environ.get('PATH_INFO', '')).lstrip('/')
+    if path == API_STREAM_PATH and method == 'GET':
+        return stream_hub.application(environ, start_response)
+    document = None
+    if '..' not in path.split('/'):
+        document = _findDocument(path)
+    if document is None:
+        if path != '' and not path.endswith('/') and _findDocument(path + '/') is not None:
+            # folder without trailing slash, like nginx
+            start_response('301 Moved Permanently', [('Location', '/' + path + '/'), ('Content-Length', '0')])
+            return []
+        store.stats['not_found'] = store.stats['not_found'] + 1
+        start_response('404 Not Found', [('Content-Type', 'text/plain'), ('Content-Length', '9')])
+        return ['not found'] if method == 'GET' else []
+
+    accepted_encodings = _acceptedEncodings(environ.get('HTTP_ACCEPT_ENCODING', ''))
+    encoding = 'identity'
+    for preferred_encoding in ('br', 'gzip'):
+        if preferred_encoding in document.variants and preferred_encoding in accepted_encodings:
+            encoding = preferred_encoding
+            break
+    body, etag = document.variants[encoding]
+
+    cache_control = API_SERVER_STATIC_CACHE_CONTROL if path in STATIC_DOCUMENTS else API_SERVER_CACHE_CONTROL
+    headers = [('ETag', etag),
+               ('Last-Modified', document.last_modified),
+               ('Vary', 'Accept-Encoding'),
+               ('Cache-Control', cache_control),
+               ('Access-Control-Allow-Origin', '*'),
+               ]
+    if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        not_modified = _etagMatches(if_none_match, etag)
+    else:
+        # exact match, as nginx does by default
+        not_modified = environ.get('HTTP_IF_MODIFIED_SINCE') == document.last_modified
+    if not_modified:
+        store.stats['not_modified'] = store.stats['not_modified'] + 1
+        start_response('304 Not Modified', headers)
+        return []
+
+    headers.append(('Content-Type', document.content_type))
+    headers.append(('Content-Length', str(len(body))))
+    if encoding != 'identity':
+        headers.append(('Content-Encoding', encoding))
+    start_response('200 OK', headers)
+    return [body] if method == 'GET' else []
+
+
+def listen(address):
+    """
+    opens the listen socket on 'host:port', raises socket.error when it can not be bound
+    """
+    host, _, port = address.rpartition(':')
+    # every stream subscriber keeps a socket open
+    soft_limit, hard_limit = resource.getrlimit(resource.RLIMIT_NOFILE)
+    files_limit = API_STREAM_MAX_CONNECTIONS + 1024
+    if hard_limit != resource.RLIM_INFINITY:
+        files_limit = min(files_limit, hard_limit)
+    if soft_limit != resource.RLIM_INFINITY and soft_limit < files_limit:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (files_limit, hard_limit))
+        except (ValueError, resource.error) as error:
+            logger.warning("can not raise open files limit: {0}".format(str(error)))
+    return eventlet.listen((host or '0.0.0.0', int(port)), backlog=1024)
+
+
+def _serveSocket(listen_socket, address):
+    logger.info("serving API on {0}".format(address))
+    eventlet.spawn(stream_hub.run)
+    eventlet.wsgi.server(listen_socket, application, log_output=False, max_size=API_STREAM_MAX_CONNECTIONS)
+
+
+def serve(address):
+    """
+    serves API documents on 'host:port' with eventlet, blocks
+    """
+    _serveSocket(listen(address), address)
+
+
+def _serveThread(listen_socket, address):
+    try:
+        _serveSocket(listen_socket, address)
+    except Exception:
+        logger.critical("API server on {0} stopped, documents are no longer served".format(address), exc_info=True)
+
+
+def start(address):
+    """
+    serves API documents from a background thread with its own eventlet hub, api_daemon cycles keep
+    running in the main thread. The socket is bound here, so a wrong or busy address stops the caller.
+    """
+    listen_socket = listen(address)
+    server_thread = threading.Thread(target=_serveThread, args=(listen_socket, address), name='api_server')
+    server_thread.daemon = True
+    server_thread.start()
+    return server_thread
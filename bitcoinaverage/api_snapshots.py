@@ -0,0 +1,76 @@
+import os
+import shutil
+import logging
+
+from bitcoinaverage.config import API_SNAPSHOTS_KEEP
+
+logger = logging.getLogger(__name__)
+
+
+class APISnapshots(object):
+    """
+    Every api_daemon cycle writes into a new generation folder under snapshots_root, prepared by hard linking
+    all files of the published generation, so unchanged files cost one link. The 'current' symlink, which
+    nginx serves, is then switched to it by an atomic rename, clients never see files of two different cycles.
+    Only the API_SNAPSHOTS_KEEP newest generations are kept.
+    """
+
+    def __init__(self, snapshots_root):
+        self.snapshots_root = snapshots_root
+        self.current_link = os.path.join(snapshots_root, 'current')
+        self.working_generation = None
+        if not os.path.exists(snapshots_root):
+            os.makedirs(snapshots_root)
+
+    def _generationPath(self, generation):
+        return os.path.join(self.snapshots_root, '{0:010d}'.format(generation))
+
+    def _generations(self):
+        return sorted(int(name) for name in os.listdir(self.snapshots_root) if name.isdigit())
+
+    def currentGeneration(self):
+        try:
+            return int(os.readlink(self.current_link))
+        except (OSError, ValueError):
+            return None
+
+    def begin(self):
+        """
+        creates the next generation folder and returns its path, API files of the cycle are written there
+        """
+        generations = self._generations()
+        self.working_generation = generations[-1] + 1 if len(generations) > 0 else 1
+        working_path = self._generationPath(self.working_generation)
+
+        current_generation = self.currentGeneration()
+        if current_generation is None:
+            os.makedirs(working_path)
+        else:
+            self._linkTree(self._generationPath(current_generation), working_path)
+        return working_path
+
+    def _linkTree(self, source_path, target_path):
+        os.mkdir(target_path)
+        for folder_path, folder_names, file_names in os.walk(source_path):
+            target_folder_path = os.path.normpath(os.path.join(target_path, os.path.relpath(folder_path, source_path)))
+            for folder_name in folder_names:
+                os.mkdir(os.path.join(target_folder_path, folder_name))
+            for file_name in file_names:
+                if file_name.endswith('.tmp'):
+                    continue
+                os.link(os.path.join(folder_path, file_name), os.path.join(target_folder_path, file_name))
+
+    def publish(self):
+        """
+        switches 'current' to the working generation and removes old generations
+        """
+        tmp_link = self.current_link + '.tmp'
+        if os.path.lexists(tmp_link):
+            os.remove(tmp_link)
+        # relative target, the snapshots folder may be moved or mounted elsewhere
+        os.symlink(os.path.basename(self._generationPath(self.working_generation)), tmp_link)
+        os.rename(tmp_link, self.current_link)
+
+        for generation in self._generations()[:-API_SNAPSHOTS_KEEP]:
+            if generation != self.working_generation:
+                shutil.rmtree(self._generationPath(generation), ignore_errors=True)
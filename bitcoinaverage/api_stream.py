@@ -0,0 +1,134 @@
+import os
+import json
+import errno
+import fcntl
+import logging
+import urlparse
+
+import eventlet
+import eventlet.event
+import eventlet.hubs
+
+from bitcoinaverage.config import (API_FILES, API_DELTA_DOCUMENTS, API_STREAM_HEARTBEAT, API_STREAM_MAX_TOPICS,
+                                   API_STREAM_RETRY)
+
+logger = logging.getLogger(__name__)
+
+
+class StreamHub(object):
+    """
+    Server-sent events of published API documents. Topics are paths of the compact API (all, ticker/USD,
+    ticker/global/all, exchanges/EUR), event ids are generations. A subscriber gets a snapshot of every topic,
+    then the delta since the generation it has (see api_deltas.py) or a new snapshot when there is no delta.
+    Subscribers are green threads of the api_server hub waiting on one event, so idle connections cost
+    a socket and a small stack each. Events of a generation are encoded once for all subscribers.
+    The store publishes from the api_daemon thread and wakes the hub through a pipe.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.generation_event = eventlet.event.Event()  # sent and replaced on every publish
+        self.events = {}  # (kind, topic, key) -> encoded event of the current generation
+        self.events_generation = None
+        self.connections = 0
+        self.notify_read_fd, self.notify_write_fd = os.pipe()
+        for notify_fd in (self.notify_read_fd, self.notify_write_fd):
+            fcntl.fcntl(notify_fd, fcntl.F_SETFL, fcntl.fcntl(notify_fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        store.listeners.append(self.notify)
+
+    def notify(self):
+        """
+        called by the store from any thread after publishing, never blocks the publisher
+        """
+        try:
+            os.write(self.notify_write_fd, '.')
+        except OSError as error:
+            # a full pipe already has a byte waiting to wake the hub
+            if error.errno != errno.EAGAIN:
+                raise
+
+    def run(self):
+        """
+        green thread of the api_server hub waking subscribers on publish
+        """
+        while True:
+            eventlet.hubs.trampoline(self.notify_read_fd, read=True)
+            try:
+                os.read(self.notify_read_fd, 4096)
+            except OSError:
+                continue
+            generation_event, self.generation_event = self.generation_event, eventlet.event.Event()
+            generation_event.send()
+
+    def _event(self, generation, kind, topic, key, body):
+        if self.events_generation != generation:
+            self.events = {}
+            self.events_generation = generation
+        event = self.events.get((kind, topic, key))
+        if event is None:
+            # compact documents and deltas are single line JSON
+            event = 'id: {0}\nevent: {1}\ndata: {{"topic":{2},"{1}":{3}}}\n\n'.format(generation, kind,
+                                                                                     json.dumps(topic), body)
+            self.events[(kind, topic, key)] = event
+        return event
+
+    def _topicEvents(self, topics, last_generation, sent_etags):
+        generation, documents = self.store.published
+        events = []
+        for topic in topics:
+            if last_generation is not None and topic in API_DELTA_DOCUMENTS:
+                delta = documents.get('{0}{1}/{2}'.format(API_FILES['DELTA_PATH'], topic, last_generation))
+                if delta is not None:
+                    events.append(self._event(generation, 'delta', topic, last_generation,
+                                              delta.variants['identity'][0]))
+                    continue
+            document = documents.get(API_FILES['COMPACT_PATH'] + topic)
+            if document is None:
+                continue
+            body, etag = document.variants['identity']
+            if sent_etags.get(topic) == etag:
+                continue
+            sent_etags[topic] = etag
+            events.append(self._event(generation, 'snapshot', topic, etag, body))
+        return generation, ''.join(events)
+
+    def _stream(self, topics, last_generation):
+        self.connections = self.connections + 1
+        try:
+            yield 'retry: {0}\n\n'.format(API_STREAM_RETRY * 1000)
+            sent_etags = {}  # topic -> ETag of the last snapshot sent
+            while True:
+                generation_event = self.generation_event
+                last_generation, events = self._topicEvents(topics, last_generation, sent_etags)
+                if events:
+                    yield events
+                with eventlet.Timeout(API_STREAM_HEARTBEAT, False):
+                    generation_event.wait()
+                    continue
+                # comment line, keeps proxies from closing the connection and finds dead clients
+                yield ': heartbeat\n\n'
+        finally:
+            self.connections = self.connections - 1
+
+    def application(self, environ, start_response):
+        parameters = urlparse.parse_qs(environ.get('QUERY_STRING', ''))
+        topics = []
+        for topics_parameter in parameters.get('topics', ['all']):
+            topics.extend(topic.strip('/') for topic in topics_parameter.split(',') if topic.strip('/'))
+        last_generation = environ.get('HTTP_LAST_EVENT_ID') or parameters.get('generation', [None])[0]
+        try:
+            last_generation = int(last_generation) if last_generation else None
+        except ValueError:
+            last_generation = None
+        if len(topics) == 0 or len(topics) > API_STREAM_MAX_TOPICS:
+            start_response('400 Bad Request', [('Content-Type', 'text/plain'), ('Content-Length', '14')])
+            return ['invalid topics']
+
+        # every event goes out at once, not in 4kB chunks
+        environ['eventlet.minimum_write_chunk_size'] = 0
+        start_response('200 OK', [('Content-Type', 'text/event-stream'),
+                                  ('Cache-Control', 'no-cache'),
+                                  ('Access-Control-Allow-Origin', '*'),
+                                  ('X-Accel-Buffering', 'no'),
+                                  ])
+        return self._stream(topics, last_generation)
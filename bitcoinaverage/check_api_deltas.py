@@ -0,0 +1,107 @@
+"""
+Randomized round trip check of api_deltas: documents of random nested objects, scalars and empty objects
+are fed to DocumentDeltas generation by generation, every delta document it keeps is applied to the document
+of its base the way applyDelta in www/js/helpers.js does it and has to give the current document.
+Prints a JSON report, exits with 1 on any wrong reconstruction.
+
+usage: python -m bitcoinaverage.check_api_deltas [--sequences N] [--length N] [--seed N]
+"""
+import sys
+import copy
+import json
+import random
+import argparse
+
+from bitcoinaverage.api_deltas import DocumentDeltas
+
+KEYS = ('a', 'b', 'c', 'd')
+MAX_DEPTH = 3
+MAX_REPORTED_MISMATCHES = 10
+
+
+def randomValue(random_generator, depth):
+    kind = random_generator.random()
+    if kind < 0.15:
+        return {}
+    if depth < MAX_DEPTH and kind < 0.6:
+        return randomObject(random_generator, depth + 1)
+    return random_generator.randint(0, 3)
+
+
+def randomObject(random_generator, depth=0):
+    return dict((key, randomValue(random_generator, depth)) for key in KEYS if random_generator.random() < 0.6)
+
+
+def randomDocument(random_generator):
+    # API documents are never empty, an empty root would be a leaf without a key
+    document = {}
+    while len(document) == 0:
+        document = randomObject(random_generator)
+    return document
+
+
+def applyDelta(document, delta):
+    """
+    port of applyDelta of www/js/helpers.js
+    """
+    for path in delta['removed']:
+        parent = document
+        for key in path[:-1]:
+            if not isinstance(parent, dict):
+                break
+            parent = parent.get(key)
+        if isinstance(parent, dict):
+            parent.pop(path[-1], None)
+
+    def merge(target, changes):
+        for key, value in changes.iteritems():
+            if isinstance(value, dict) and len(value) > 0:
+                if not isinstance(target.get(key), dict):
+                    target[key] = {}
+                merge(target[key], value)
+            else:
+                target[key] = value
+
+    merge(document, delta['changes'])
+    return document
+
+
+def main():
+    parser = argparse.ArgumentParser(description='check delta API documents against the documents they rebuild')
+    parser.add_argument('--sequences', type=int, default=3000, help='random document sequences to check')
+    parser.add_argument('--length', type=int, default=8, help='generations of every sequence')
+    parser.add_argument('--seed', type=int, default=1, help='random seed')
+    args = parser.parse_args()
+
+    random_generator = random.Random(args.seed)
+    deltas_count = 0
+    mismatches = []
+    for sequence in xrange(args.sequences):
+        document_deltas = DocumentDeltas(generations=args.length)
+        documents = {}  # generation -> document
+        for generation in xrange(1, args.length + 1):
+            document = randomDocument(random_generator)
+            documents[generation] = document
+            document_deltas.update(generation, document)
+            for base, delta in document_deltas.deltaDocuments(generation):
+                deltas_count = deltas_count + 1
+                # deltas reach clients as JSON, paths become lists
+                rebuilt = applyDelta(copy.deepcopy(documents[base]), json.loads(json.dumps(delta)))
+                if rebuilt != document:
+                    mismatches.append({'sequence': sequence,
+                                       'base': documents[base],
+                                       'document': document,
+                                       'rebuilt': rebuilt,
+                                       })
+
+    report = {'sequences': args.sequences,
+              'deltas': deltas_count,
+              'mismatches': len(mismatches),
+              'first_mismatches': mismatches[:MAX_REPORTED_MISMATCHES],
+              }
+    print json.dumps(report, indent=2, sort_keys=True, separators=(',', ': '))
+    return 1 if len(mismatches) > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
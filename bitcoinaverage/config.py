@@ -17,12 +17,89 @@ API_FILES = {'TICKER_PATH': 'ticker/',
              'EXCHANGES_PATH': 'exchanges/',
              'ALL_FILE': 'all',
              'IGNORED_FILE': 'ignored',
-             'CUSTOM_API': 'custom/'
+             'CUSTOM_API': 'custom/',
+             'COMPACT_PATH': 'compact/',  # minified JSON copies of the documents above, see writeCompactAPIFiles
+             'MSGPACK_PATH': 'msgpack/',  # MessagePack copies, written when the optional msgpack module is installed
+             'DELTA_PATH': 'delta/',  # delta/<document>/<generation> - changes of the document since that generation
+             'EXCHANGES_METADATA_FILE': 'metadata',  # exchanges/metadata - display names, URLs and colors of exchanges
+             'BUNDLE_PATH': 'bundle/',  # bundle/<currency> - what a currency page or the embed widget shows
+             'VERSION_FILE': 'version',  # <family>version - generation and data hashes of the family documents
              }
+# seconds between regenerations of API endpoint families by api_daemon, 0 - every cycle (API_WRITE_FREQUENCY),
+# a family is always written as a whole with the timestamp of the cycle it was calculated in
+API_PUBLISH_TIERS = {'core': 0,  # all, ticker/*, ticker/global/all, exchanges/*, ignored, compact copies, deltas,
+                                # versions, bundles of CURRENCY_LIST
+                     'global_tickers': 60,  # ticker/global/<currency> and bundle/<currency> of currencies not in CURRENCY_LIST
+                     'key_files': 30,  # plain text ticker/<currency>/<key> and ticker/global/<currency>/<key>
+                     'custom': 0,  # custom/ partner feeds, each is rewritten at its own interval (CUSTOM_API_FEEDS)
+                     'sitemap': 3600,  # sitemap.xml, currency pages change only with fiat rates
+                     }
 
-CUSTOM_API_FILES = {'AndroidBitcoinWallet': 'abw',
-                    'HiveMacDesktopWallet': 'hive_mac',
-                    'HiveAndroidWallet': 'hive_android',
+# gzip levels of API files by endpoint class: 'all' - aggregated documents (/all, /ticker/all, /ticker/global/all,
+# /exchanges/all), 'ticker', 'exchanges', 'custom', 'history' - other files in these folders, '_default' - the rest
+API_GZIP_LEVELS = {'all': 9,
+                   'ticker': 6,
+                   'exchanges': 6,
+                   'custom': 6,
+                   'history': 6,
+                   '_default': 6,
+                   }
+API_COMPRESS_WORKERS = 4  # threads compressing API files, 0 - compress in the writing thread
+API_IO_WORKERS = 4  # threads writing batches of per key ticker files, one batch per folder, 0 - write in the daemon thread
+# API files (relative to API_DOCUMENT_ROOT) also written as .br, needs the optional brotli module, empty - disabled
+API_BROTLI_FILES = ('all',
+                    'ticker/all',
+                    'ticker/global/all',
+                    'exchanges/all',
+                    )
+API_BROTLI_QUALITY = 11
+# documents of the delta API, see api_deltas.py, and how many past generations (cycles) have a delta there
+API_DELTA_DOCUMENTS = ('all',
+                       'ticker/all',
+                       'ticker/global/all',
+                       'exchanges/all',
+                       )
+API_DELTA_GENERATIONS = 12  # two minutes of cycles, clients polling every FRONTEND_QUERY_FREQUENCY seconds stay well within
+API_BUNDLE_SPARKLINE_SECONDS = 3600  # sparkline of bundle documents, samples of the 24h rolling window
+# endpoint families with a version probe, see writeVersionAPIFiles, documents of CURRENCY_LIST
+# directly in the folder of a family are listed in its probe ('' - /all and /ignored)
+API_VERSION_FAMILIES = ('',
+                        API_FILES['TICKER_PATH'],
+                        API_FILES['GLOBAL_TICKER_PATH'],
+                        API_FILES['EXCHANGES_PATH'],
+                        )
+API_SERVER_CACHE_CONTROL = 'public, max-age=10'  # Cache-Control of documents served from memory, see api_server.py
+API_SERVER_STATIC_CACHE_CONTROL = 'public, max-age=86400'  # documents written once at startup, exchanges/metadata
+# server-sent events of api_server.py, see api_stream.py
+API_STREAM_PATH = 'stream'
+API_STREAM_MAX_CONNECTIONS = 20000  # concurrent connections of api_server, open files limit is raised for them
+API_STREAM_MAX_TOPICS = 50  # topics of one subscriber
+API_STREAM_HEARTBEAT = 20  # seconds between comments sent to idle subscribers
+API_STREAM_RETRY = 5  # seconds browsers wait before reconnecting
+
+# custom/<file_name> partner feeds, projections of the formatted API data compiled once by api_custom_writers:
+# source - 'averages', 'exchanges' or 'global_averages' block of every currency, currencies - subset of them
+# (None - all currencies of the source), fields - keys of the block to keep (None - the whole block), first_field -
+# keep only the first of fields a currency has, format - 'json', 'compact' (minified, sorted keys) or 'pretty'
+# (as the API files), interval - seconds between rewrites. Feeds with the same projection are evaluated once.
+CUSTOM_API_FEEDS = {'AndroidBitcoinWallet': {'file_name': 'abw',
+                                             'source': 'global_averages',
+                                             'fields': ('24h_avg', 'last'),
+                                             'first_field': True,
+                                             'interval': 0,
+                                             },
+                    'HiveMacDesktopWallet': {'file_name': 'hive_mac',
+                                             'source': 'global_averages',
+                                             'fields': ('24h_avg', 'last'),
+                                             'first_field': True,
+                                             'interval': 0,
+                                             },
+                    'HiveAndroidWallet': {'file_name': 'hive_android',
+                                          'source': 'global_averages',
+                                          'fields': ('24h_avg', 'last'),
+                                          'first_field': True,
+                                          'interval': 0,
+                                          },
                     }
 
 API_REQUEST_HEADERS = {'User-Agent': 'bitcoinaverage.com query bot',
@@ -54,6 +131,21 @@ API_IGNORE_TIMEOUT = 1800
 
 # API daemon write frequency
 API_WRITE_FREQUENCY = 10
+# generation folders kept under API_SNAPSHOTS_ROOT (see server.py.dist), clients may still read older ones
+API_SNAPSHOTS_KEEP = 3
+# seconds of an api daemon cycle after which low priority stages (plain key files, custom APIs, sitemap) are deferred,
+# core API files are always written
+API_CYCLE_BUDGET = 7
+# cycles in a row a low priority stage may be deferred before it runs regardless of the budget
+API_STAGE_MAX_DEFERRALS = 6
+
+# bytes of TRACE_LOG_PATH (see server.py.dist) after which it is rotated to <name>.1
+TRACE_LOG_MAX_SIZE = 50 * 1024 * 1024
+
+# sampling profiler started by SIGUSR2 or by a profile_<daemon name> file in the log folder
+PROFILER_DURATION = 30  # seconds of sampling, unless the trigger file contains another number
+PROFILER_INTERVAL = 0.005  # seconds of CPU time between samples
+PROFILER_TOP_FUNCTIONS = 50  # functions listed in the top summary
 
 DEC_PLACES = Decimal('0.00')
 
@@ -0,0 +1,94 @@
+import gzip
+import logging
+import simplejson as json
+
+logger = logging.getLogger(__name__)
+
+
+class CycleRecorder(object):
+    """
+    Appends api_daemon cycle inputs to a gzip compressed log, one JSON line per cycle. Only exchanges
+    whose raw redis data changed are stored, ignored exchanges and fiat rates only when they changed.
+    Every cycle is a separate gzip member, so the log stays readable if the daemon is killed.
+    """
+
+    def __init__(self, log_path):
+        self.log_path = log_path
+        self.raw_exchanges = None
+        self.exchanges_ignored = None
+        self.fiat_rates_generation = None
+
+    def record(self, current_time, raw_exchanges, exchanges_ignored, fiat_rates_cache):
+        cycle = {'time': current_time}
+        if self.raw_exchanges is None:
+            # first cycle written by this process, readers start over from here
+            cycle['full'] = True
+            cycle['exchanges'] = raw_exchanges
+        else:
+            cycle['exchanges'] = dict((exchange_name, exchange_data)
+                                      for exchange_name, exchange_data in raw_exchanges.iteritems()
+                                      if self.raw_exchanges.get(exchange_name) != exchange_data)
+            removed_exchanges = [exchange_name for exchange_name in self.raw_exchanges
+                                 if exchange_name not in raw_exchanges]
+            if len(removed_exchanges) > 0:
+                cycle['removed'] = removed_exchanges
+        # order of redis data matters for rounding of averages
+        cycle['order'] = raw_exchanges.keys()
+        if exchanges_ignored != self.exchanges_ignored:
+            cycle['ignored'] = exchanges_ignored
+        if fiat_rates_cache.generation != self.fiat_rates_generation:
+            cycle['fiat_rates'] = fiat_rates_cache.currencies
+
+        try:
+            with gzip.open(self.log_path, 'ab') as log_file:
+                log_file.write(json.dumps(cycle, separators=(',', ':')) + '\n')
+        except IOError as error:
+            logger.error("can not write cycle log {0}: {1}".format(self.log_path, str(error)))
+            return
+
+        self.raw_exchanges = dict(raw_exchanges)
+        self.exchanges_ignored = dict(exchanges_ignored)
+        self.fiat_rates_generation = fiat_rates_cache.generation
+
+
+def readCycles(log_path):
+    """
+    Yields (time, raw_exchanges, exchanges_ignored, fiat_rates) for every recorded cycle,
+    fiat_rates is None when they did not change since the previous cycle
+    """
+    raw_exchanges = {}
+    exchanges_ignored = {}
+    with gzip.open(log_path, 'rb') as log_file:
+        for line in log_file:
+            cycle = json.loads(line)
+            if cycle.get('full'):
+                raw_exchanges = {}
+            for exchange_name in cycle.get('removed', []):
+                raw_exchanges.pop(exchange_name, None)
+            raw_exchanges.update(cycle['exchanges'])
+            if 'ignored' in cycle:
+                exchanges_ignored = cycle['ignored']
+
+            yield (cycle['time'],
+                   OrderedRawExchanges(cycle['order'], raw_exchanges),
+                   exchanges_ignored,
+                   cycle.get('fiat_rates'))
+
+
+class OrderedRawExchanges(dict):
+    """
+    dict of raw exchange data iterating in the order it was read from redis
+    """
+
+    def __init__(self, order, raw_exchanges):
+        dict.__init__(self, ((exchange_name, raw_exchanges[exchange_name]) for exchange_name in order))
+        self.order = order
+
+    def __iter__(self):
+        return iter(self.order)
+
+    def keys(self):
+        return list(self.order)
+
+    def iteritems(self):
+        return ((exchange_name, self[exchange_name]) for exchange_name in self.order)
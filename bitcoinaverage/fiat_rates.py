@@ -0,0 +1,76 @@
+import os
+import time
+import json
+import logging
+from decimal import Decimal, InvalidOperation
+
+import bitcoinaverage as ba
+from bitcoinaverage.config import CURRENCY_LIST
+
+logger = logging.getLogger(__name__)
+
+
+class FiatRatesCache(object):
+    """
+    In-process copy of fiat exchange rates, refreshed by helpers.write_fiat_rates_config
+    and persisted to disk, so api_daemon does not query its own fiat_data API every cycle
+    """
+
+    def __init__(self):
+        self.currencies = {}  # same structure as fiat_data API file - {code: {'name': ..., 'rate': ...}}
+        self.rates = {}  # {code: Decimal rate} for every fiat currency
+        self.currency_list_rates = ()  # Decimal rates in CURRENCY_LIST order
+        self.fetched_at = 0
+        self.generation = 0  # incremented on every update, lets consumers detect changed rates
+
+    def is_empty(self):
+        return len(self.currencies) == 0
+
+    def update(self, currencies, fetched_at=None, persist=True):
+        try:
+            rates = {}
+            for currency_code in currencies:
+                rates[currency_code] = Decimal(currencies[currency_code]['rate'])
+            currency_list_rates = tuple(rates[currency_code] for currency_code in CURRENCY_LIST)
+        except (KeyError, TypeError, InvalidOperation) as error:
+            logger.error("fiat rates not updated, invalid data: {0}".format(str(error)))
+            return False
+
+        self.currencies = currencies
+        self.rates = rates
+        self.currency_list_rates = currency_list_rates
+        self.fetched_at = fetched_at if fetched_at is not None else int(time.time())
+        self.generation = self.generation + 1
+
+        if persist:
+            self.save()
+        return True
+
+    def save(self):
+        cache_file_path = ba.server.FIAT_RATES_CACHE_PATH
+        if not os.path.exists(os.path.dirname(cache_file_path)):
+            os.makedirs(os.path.dirname(cache_file_path))
+
+        with open(cache_file_path + '.tmp', 'w') as cache_file:
+            cache_file.write(json.dumps({'fetched_at': self.fetched_at,
+                                         'currencies': self.currencies,
+                                         }))
+        os.rename(cache_file_path + '.tmp', cache_file_path)
+
+    def load(self):
+        try:
+            with open(ba.server.FIAT_RATES_CACHE_PATH, 'r') as cache_file:
+                cache_data = json.loads(cache_file.read())
+            currencies = cache_data['currencies']
+            fetched_at = cache_data['fetched_at']
+        except (IOError, ValueError, KeyError, TypeError) as error:
+            logger.warning("can not load fiat rates cache {0}: {1}".format(ba.server.FIAT_RATES_CACHE_PATH, str(error)))
+            return False
+
+        if self.update(currencies, fetched_at=fetched_at, persist=False):
+            logger.info("loaded fiat rates cache, {0}s old".format(int(time.time()) - self.fetched_at))
+            return True
+        return False
+
+
+cache = FiatRatesCache()
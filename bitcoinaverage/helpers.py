@@ -1,6 +1,5 @@
 from decimal import Decimal
 import os
-from shutil import copyfile
 import time
 import json
 from email import utils
@@ -18,6 +17,23 @@ import bitcoinaverage as ba
 from bitcoinaverage.config import API_CALL_TIMEOUT_THRESHOLD, API_REQUEST_HEADERS, API_FILES
 from bitcoinaverage.server import OPENEXCHANGERATES_APP_ID
 from bitcoinaverage.exceptions import CallTimeoutException
+from bitcoinaverage import fiat_rates
+from bitcoinaverage import api_files
+
+
+def exchange_color(exchange_name):
+    return "#" + hashlib.md5(exchange_name.encode()).hexdigest()[:6]
+
+
+def exchanges_metadata():
+    metadata = {}
+    for exchange_name, exchange_config in ba.config.EXCHANGE_LIST.iteritems():
+        metadata[exchange_name] = {'display_name': exchange_config.get('display_name', exchange_name),
+                                   'color': exchange_color(exchange_name),
+                                   }
+        if 'URL' in exchange_config:
+            metadata[exchange_name]['display_URL'] = exchange_config['URL']
+    return metadata
 
 
 def write_js_config():
@@ -25,11 +41,10 @@ def write_js_config():
 
     js_config_template = 'var config = $CONFIG_DATA;'
 
-    exchange_color = lambda name: "#" + hashlib.md5(name.encode()).hexdigest()[:6]
-
     config_data = {}
     config_data['apiIndexUrl'] = ba.server.API_INDEX_URL
     config_data['apiHistoryIndexUrl'] = ba.server.API_INDEX_URL_HISTORY
+    config_data['apiStreamUrl'] = getattr(ba.server, 'API_STREAM_URL', '')
     config_data['refreshRate'] = str(ba.config.FRONTEND_QUERY_FREQUENCY*1000) #JS requires value in milliseconds
     config_data['currencyOrder'] = ba.config.CURRENCY_LIST
     config_data['legendSlots'] = ba.config.FRONTEND_LEGEND_SLOTS
@@ -37,7 +52,9 @@ def write_js_config():
     config_data['scaleDivizer'] = ba.config.FRONTEND_SCALE_DIVIZER
     config_data['precision'] = ba.config.FRONTEND_PRECISION
     config_data['chartType'] = ba.config.FRONTEND_CHART_TYPE
-    config_data['exchangesColors'] = {ex: exchange_color(ex) for ex in ba.config.EXCHANGE_LIST.keys()}
+    config_data['exchangesMetadata'] = exchanges_metadata()
+    config_data['exchangesColors'] = dict((exchange_name, metadata['color'])
+                                          for exchange_name, metadata in config_data['exchangesMetadata'].iteritems())
     config_data['currencySymbols'] = ba.config.FRONTEND_CURRENCY_SYMBOLS
     config_data['apiUsers'] = ba.config.API_USERS
     config_string = js_config_template.replace('$CONFIG_DATA',
@@ -79,14 +96,17 @@ def write_fiat_rates_config():
         except (KeyError, TypeError):
             return None
 
+    fiat_rates.cache.update(currency_data_list)
+
     config_string = js_config_template
     config_string = config_string.replace('$FIAT_CURRENCIES_DATA$', json.dumps(currency_data_list))
 
     with open(os.path.join(ba.server.WWW_DOCUMENT_ROOT, 'js', 'fiat_data.js'), 'w') as fiat_exchange_config_file:
         fiat_exchange_config_file.write(config_string)
 
-    with open(os.path.join(ba.server.API_DOCUMENT_ROOT, 'fiat_data'), 'w') as fiat_exchange_api_file:
-        fiat_exchange_api_file.write(json.dumps(currency_data_list))
+    write_api_file(os.path.join(ba.server.API_DOCUMENT_ROOT, 'fiat_data'),
+                   json.dumps(currency_data_list),
+                   compress=False)
 
 
 def write_html_currency_pages():
@@ -226,12 +246,11 @@ def write_api_index_files():
 
     global ba
 
-    if not os.path.exists(os.path.join(ba.server.API_DOCUMENT_ROOT, 'favicon.ico')):
-        try:
-            copyfile(os.path.join(ba.server.WWW_DOCUMENT_ROOT, 'favicon.ico'),
-                     os.path.join(ba.server.API_DOCUMENT_ROOT, 'favicon.ico'))
-        except IOError:
-            pass
+    try:
+        with open(os.path.join(ba.server.WWW_DOCUMENT_ROOT, 'favicon.ico'), 'rb') as favicon_file:
+            write_api_file(os.path.join(ba.server.API_DOCUMENT_ROOT, 'favicon.ico'), favicon_file.read(), compress=False)
+    except IOError:
+        pass
 
     #api root index
     api_index = {}
@@ -240,56 +259,46 @@ def write_api_index_files():
     api_index['exchanges'] = ba.server.API_INDEX_URL + API_FILES['EXCHANGES_PATH']
     api_index['all'] = ba.server.API_INDEX_URL + API_FILES['ALL_FILE']
     api_index['ignored'] = ba.server.API_INDEX_URL + API_FILES['IGNORED_FILE']
+    api_index['bundles'] = ba.server.API_INDEX_URL + API_FILES['BUNDLE_PATH']
     api_index['history'] = ba.server.API_INDEX_URL_HISTORY
     write_api_file(
         os.path.join(ba.server.API_DOCUMENT_ROOT, ba.config.INDEX_DOCUMENT_NAME),
         json.dumps(api_index, indent=2, sort_keys=True, separators=(',', ': ')))
 
     #api tickers index
-    if not os.path.exists(os.path.join(ba.server.API_DOCUMENT_ROOT, API_FILES['TICKER_PATH'])):
-        os.makedirs(os.path.join(ba.server.API_DOCUMENT_ROOT, API_FILES['TICKER_PATH']))
+    make_api_folder(os.path.join(ba.server.API_DOCUMENT_ROOT, API_FILES['TICKER_PATH']))
 
     api_ticker_index = {}
     api_ticker_index['all'] = ba.server.API_INDEX_URL + API_FILES['TICKER_PATH'] + API_FILES['ALL_FILE']
     api_ticker_folder_path = os.path.join(ba.server.API_DOCUMENT_ROOT, API_FILES['TICKER_PATH'])
     for currency_code in ba.config.CURRENCY_LIST:
         api_ticker_index[currency_code] = ba.server.API_INDEX_URL + API_FILES['TICKER_PATH'] + currency_code
-        if not os.path.exists(os.path.join(api_ticker_folder_path, currency_code)):
-            os.makedirs(os.path.join(api_ticker_folder_path, currency_code))
+        make_api_folder(os.path.join(api_ticker_folder_path, currency_code))
     write_api_file(
         os.path.join(ba.server.API_DOCUMENT_ROOT, API_FILES['TICKER_PATH'], ba.config.INDEX_DOCUMENT_NAME),
         json.dumps(api_ticker_index, indent=2, sort_keys=True, separators=(',', ': ')))
 
     #api global tickers index
-    if not os.path.exists(os.path.join(ba.server.API_DOCUMENT_ROOT, API_FILES['GLOBAL_TICKER_PATH'])):
-        os.makedirs(os.path.join(ba.server.API_DOCUMENT_ROOT, API_FILES['GLOBAL_TICKER_PATH']))
+    make_api_folder(os.path.join(ba.server.API_DOCUMENT_ROOT, API_FILES['GLOBAL_TICKER_PATH']))
 
     api_ticker_index = {}
     api_ticker_index['all'] = ba.server.API_INDEX_URL + API_FILES['GLOBAL_TICKER_PATH'] + API_FILES['ALL_FILE']
     api_ticker_folder_path = os.path.join(ba.server.API_DOCUMENT_ROOT, API_FILES['GLOBAL_TICKER_PATH'])
 
-    try:
-        fiat_exchange_rates_url = ba.server.API_INDEX_URL + 'fiat_data'
-        with Timeout(API_CALL_TIMEOUT_THRESHOLD, CallTimeoutException):
-            result = urllib2.urlopen(urllib2.Request(url=fiat_exchange_rates_url, headers=API_REQUEST_HEADERS)).read()
-            fiat_currencies_list = json.loads(result)
-
-        for currency_code in fiat_currencies_list:
+    if not fiat_rates.cache.is_empty():
+        for currency_code in fiat_rates.cache.currencies:
             api_ticker_index[currency_code] = ba.server.API_INDEX_URL + API_FILES['GLOBAL_TICKER_PATH'] + currency_code
-            if not os.path.exists(os.path.join(api_ticker_folder_path, currency_code)):
-                os.makedirs(os.path.join(api_ticker_folder_path, currency_code))
+            make_api_folder(os.path.join(api_ticker_folder_path, currency_code))
         write_api_file(
             os.path.join(ba.server.API_DOCUMENT_ROOT, API_FILES['GLOBAL_TICKER_PATH'], ba.config.INDEX_DOCUMENT_NAME),
             json.dumps(api_ticker_index, indent=2, sort_keys=True, separators=(',', ': ')))
-    except (KeyError,ValueError,socket.error,simplejson.decoder.JSONDecodeError,urllib2.URLError,httplib.BadStatusLine,CallTimeoutException):
-        pass
 
     #api exchanges index
-    if not os.path.exists(os.path.join(ba.server.API_DOCUMENT_ROOT, API_FILES['EXCHANGES_PATH'])):
-        os.makedirs(os.path.join(ba.server.API_DOCUMENT_ROOT, API_FILES['EXCHANGES_PATH']))
+    make_api_folder(os.path.join(ba.server.API_DOCUMENT_ROOT, API_FILES['EXCHANGES_PATH']))
 
     api_exchanges_index = {}
     api_exchanges_index['all'] = ba.server.API_INDEX_URL + API_FILES['EXCHANGES_PATH'] + API_FILES['ALL_FILE']
+    api_exchanges_index['metadata'] = ba.server.API_INDEX_URL + API_FILES['EXCHANGES_PATH'] + API_FILES['EXCHANGES_METADATA_FILE']
     for currency_code in ba.config.CURRENCY_LIST:
         api_exchanges_index[currency_code] = ba.server.API_INDEX_URL + API_FILES['EXCHANGES_PATH'] + currency_code
     write_api_file(
@@ -310,15 +319,35 @@ def write_api_index_files():
     write_api_file(
         general_index_file_path,
         json.dumps(currency_history_links_list, indent=2, sort_keys=True, separators=(',', ': ')))
+    api_files.writer.flush()
+
+
+def write_exchanges_metadata():
+    """
+    /exchanges/metadata, static data of EXCHANGE_LIST left out of exchange rows by the lean schema (API_LEAN_SCHEMA),
+    written at startup only
+    """
+    exchanges_path = os.path.join(ba.server.API_DOCUMENT_ROOT, API_FILES['EXCHANGES_PATH'])
+    make_api_folder(exchanges_path)
+    write_api_file(
+        os.path.join(exchanges_path, API_FILES['EXCHANGES_METADATA_FILE']),
+        json.dumps(exchanges_metadata(), indent=2, sort_keys=True, separators=(',', ': ')))
 
 
 def write_api_file(api_file_name, content, compress=True):
-    with open(api_file_name, 'w') as api_file:
-        api_file.write(content)
-    if compress:
-        with open(api_file_name, 'rb') as api_file:
-            with gzip.open(api_file_name + '.gz', 'wb') as api_gzipped_file:
-                api_gzipped_file.writelines(api_file)
+    return api_files.writer.write(api_file_name, content, compress)
+
+
+def remove_api_file(api_file_name):
+    return api_files.writer.remove(api_file_name)
+
+
+def write_api_folder(folder_path, contents):
+    return api_files.writer.writeFolder(folder_path, contents)
+
+
+def make_api_folder(folder_path):
+    api_files.writer.makeFolder(folder_path)
 
 
 def gzip_history_file(history_file_name):
@@ -0,0 +1,119 @@
+import logging
+import simplejson as json
+
+from bitcoinaverage.config import DEC_PLACES, CURRENCY_LIST
+from bitcoinaverage import fiat_rates
+from bitcoinaverage import rolling_averages
+from bitcoinaverage import tracing
+from bitcoinaverage.api_calculations import (createExchangeRecord, calculateCurrencyForAPI, calculateAllGlobalAverages,
+                                             formatGlobalAveragesForAPI, get24hAverage, get24hGlobalAverage)
+
+logger = logging.getLogger(__name__)
+
+
+def _exchangeCurrencies(exchange_record):
+    return set(CURRENCY_LIST[ticker.currency_id] for ticker in exchange_record.tickers if ticker is not None)
+
+
+class ExchangesTracker(object):
+    """
+    Keeps exchange records between api_daemon cycles and reports which currencies are affected
+    by exchanges whose raw data in redis changed since the previous cycle
+    """
+
+    def __init__(self):
+        self.raw_exchanges = {}
+        self.exchange_records = {}
+
+    def update(self, raw_exchanges):
+        dirty_currencies = set()
+        for exchange_name, exchange_data in raw_exchanges.iteritems():
+            if self.raw_exchanges.get(exchange_name) == exchange_data:
+                continue
+            if exchange_name in self.exchange_records:
+                dirty_currencies.update(_exchangeCurrencies(self.exchange_records[exchange_name]))
+            self.raw_exchanges[exchange_name] = exchange_data
+            self.exchange_records[exchange_name] = createExchangeRecord(json.loads(exchange_data, use_decimal=True))
+            dirty_currencies.update(_exchangeCurrencies(self.exchange_records[exchange_name]))
+
+        for exchange_name in self.raw_exchanges.keys():
+            if exchange_name not in raw_exchanges:
+                dirty_currencies.update(_exchangeCurrencies(self.exchange_records[exchange_name]))
+                del self.raw_exchanges[exchange_name]
+                del self.exchange_records[exchange_name]
+
+        return dirty_currencies
+
+    def exchangeRecords(self, raw_exchanges):
+        # same order as the redis data, averages are quantized after every exchange so order matters
+        return [self.exchange_records[exchange_name] for exchange_name in raw_exchanges]
+
+
+class IncrementalCalculator(object):
+    """
+    Keeps calculated and formatted results per currency between cycles and recalculates only
+    currencies whose exchanges changed. Global averages depend on every currency, they are
+    recalculated when any currency or the fiat rates changed.
+    """
+
+    def __init__(self):
+        self.total_currency_volumes = {}
+        self.calculated_average_rates = {}
+        self.calculated_global_average_rates = {}
+        self.calculated_global_volume_percents = {}
+        self.calculated_average_rates_formatted = {}
+        self.calculated_volumes_formatted = {}
+        self.calculated_global_average_rates_formatted = {}
+        self.fiat_rates_generation = None
+        self.initialized = False
+
+    def update(self, exchange_records, dirty_currencies, current_timestamp):
+        if self.initialized:
+            currencies = [currency for currency in CURRENCY_LIST if currency in dirty_currencies]
+        else:
+            currencies = list(CURRENCY_LIST)
+
+        with tracing.span('currencies'):
+            for currency in currencies:
+                currency_id = CURRENCY_LIST.index(currency)
+                ticker_records = [exchange.tickers[currency_id] for exchange in exchange_records
+                                  if exchange.tickers[currency_id] is not None]
+                (self.total_currency_volumes[currency],
+                 self.calculated_average_rates[currency],
+                 self.calculated_average_rates_formatted[currency],
+                 self.calculated_volumes_formatted[currency]) = calculateCurrencyForAPI(currency, ticker_records)
+
+        if len(currencies) > 0 or self.fiat_rates_generation != fiat_rates.cache.generation:
+            with tracing.span('global_averages'):
+                self.calculated_global_average_rates, self.calculated_global_volume_percents = calculateAllGlobalAverages(
+                    self.calculated_average_rates,
+                    self.total_currency_volumes)
+            with tracing.span('format_global_averages'):
+                self.calculated_global_average_rates_formatted = formatGlobalAveragesForAPI(
+                    self.calculated_global_average_rates,
+                    self.total_currency_volumes,
+                    self.calculated_global_volume_percents)
+            self.fiat_rates_generation = fiat_rates.cache.generation
+        self.initialized = True
+
+        with tracing.span('rolling_averages'):
+            rolling_averages.record_cycle(self.calculated_average_rates, self.calculated_global_average_rates,
+                                          current_timestamp)
+            self._refresh24hAverages()
+
+        logger.debug("recalculated {0} of {1} currencies".format(len(currencies), len(CURRENCY_LIST)))
+        return (self.calculated_average_rates_formatted,
+                self.calculated_volumes_formatted,
+                self.calculated_global_average_rates_formatted)
+
+    def _refresh24hAverages(self):
+        # 24h averages move with time even for currencies without new exchange data
+        for currency in self.calculated_average_rates_formatted:
+            self.calculated_average_rates_formatted[currency]['24h_avg'] = float(get24hAverage(currency))
+        for currency in CURRENCY_LIST:
+            if currency in self.calculated_global_average_rates_formatted:
+                currency_24h_avg = get24hGlobalAverage(currency)
+                if currency_24h_avg > DEC_PLACES:
+                    self.calculated_global_average_rates_formatted[currency]['24h_avg'] = float(currency_24h_avg)
+                else:
+                    self.calculated_global_average_rates_formatted[currency].pop('24h_avg', None)
@@ -0,0 +1,98 @@
+import json
+
+INDENT = '  '
+
+
+def encode(value):
+    """
+    same output as the pretty printed API documents, json.dumps(value, indent=2, sort_keys=True, separators=(',', ': '))
+    """
+    return json.dumps(value, indent=2, sort_keys=True, separators=(',', ': '))
+
+
+def assembleObject(items):
+    """
+    JSON object from (key, fragment) pairs sorted by key, fragments are encoded at top level and get indented
+    one level deeper, the result equals encode() of the whole object
+    """
+    if len(items) == 0:
+        return '{}'
+    return '{\n' + ',\n'.join(INDENT + _encodeKey(key) + ': ' + fragment.replace('\n', '\n' + INDENT)
+                              for key, fragment in items) + '\n}'
+
+
+_encoded_keys = {}
+
+
+def _encodeKey(key):
+    # keys (currencies, exchanges, field names) repeat in every document
+    encoded_key = _encoded_keys.get(key)
+    if encoded_key is None:
+        encoded_key = json.dumps(key)
+        _encoded_keys[key] = encoded_key
+    return encoded_key
+
+
+def withItem(items, key, fragment):
+    """
+    items with one more (key, fragment) pair, kept sorted by key
+    """
+    result = [item for item in items if item[0] != key]
+    result.append((key, fragment))
+    result.sort(key=lambda item: item[0])
+    return result
+
+
+class FragmentCache(object):
+    """
+    Encoded values of API documents reused between api_daemon cycles, pretty printing makes python2 json
+    fall back to its python encoder. Every item of a cached dict is fingerprinted by its repr, which is C fast,
+    and encoded again only when it changed, e.g. a single exchange of a currency or the 24h average of a ticker.
+    """
+
+    def __init__(self):
+        self.fragments = {}  # name -> [sorted (key, fragment) items, assembled object or None]
+        self.item_fragments = {}  # (name, key) -> (repr of item value, fragment)
+        self.hits = 0
+        self.misses = 0
+
+    def _entry(self, name, value):
+        entry = self.fragments.get(name)
+        changed = entry is None or len(entry[0]) != len(value)
+        items = []
+        for key, item_value in value.iteritems():
+            item_repr = repr(item_value)
+            cached_item = self.item_fragments.get((name, key))
+            if cached_item is not None and cached_item[0] == item_repr:
+                self.hits = self.hits + 1
+                items.append((key, cached_item[1]))
+                continue
+            self.misses = self.misses + 1
+            changed = True
+            fragment = encode(item_value)
+            self.item_fragments[(name, key)] = (item_repr, fragment)
+            items.append((key, fragment))
+
+        if changed or [key for key, fragment in entry[0]] != sorted(value):
+            items.sort(key=lambda item: item[0])
+            entry = [items, None]
+            self.fragments[name] = entry
+        return entry
+
+    def objectItems(self, name, value):
+        """
+        sorted (key, fragment) items of dict value, items are encoded again only when they change
+        """
+        return self._entry(name, value)[0]
+
+    def object(self, name, value):
+        """
+        encoded dict value, assembled again only when its items change
+        """
+        entry = self._entry(name, value)
+        if entry[1] is None:
+            entry[1] = assembleObject(entry[0])
+        return entry[1]
+
+
+cache = FragmentCache()
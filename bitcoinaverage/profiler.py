@@ -0,0 +1,171 @@
+import os
+import sys
+import time
+import signal
+import logging
+import threading
+
+import bitcoinaverage as ba
+from bitcoinaverage.config import PROFILER_DURATION, PROFILER_INTERVAL, PROFILER_TOP_FUNCTIONS
+
+logger = logging.getLogger(__name__)
+
+
+def _daemonName():
+    return os.path.splitext(os.path.basename(sys.argv[0] or 'python'))[0]
+
+
+def _frameName(frame):
+    code = frame.f_code
+    return '{0}:{1}'.format(os.path.basename(code.co_filename), code.co_name)
+
+
+class SamplingProfiler(object):
+    """
+    Statistical profiler started in a running daemon by SIGUSR2 or by creating <log dir>/profile_<daemon name>
+    (optionally containing seconds to sample). While sampling, SIGPROF fires every PROFILER_INTERVAL seconds
+    of CPU time of the process and the stack of every thread is counted, prefixed by the thread name: the
+    api_server hub thread and the compression and I/O pools are sampled with the main thread. With eventlet
+    a thread's stack is the one of its green thread which was running. Threads waiting on a lock or socket
+    are counted too, in their wait frames. When not sampling no timer is set, so it costs nothing.
+    Signal handlers only count stacks and set flags, results are written by poll() at the next cycle.
+    """
+
+    def __init__(self):
+        self.daemon_name = _daemonName()
+        self.samples = {}  # collapsed stack -> samples
+        self.sample_count = 0  # SIGPROF ticks, every tick samples all threads
+        self.stop_time = None
+        self.finished = False  # deadline passed in the SIGPROF handler, poll() writes the results
+
+    def install(self):
+        try:
+            signal.signal(signal.SIGUSR2, self._onStartSignal)
+            signal.signal(signal.SIGPROF, self._onSample)
+        except ValueError:
+            # signals can be installed only from the main thread
+            return False
+        # do not break sleeps and socket reads of the daemon, python2 does not retry them
+        signal.siginterrupt(signal.SIGUSR2, False)
+        signal.siginterrupt(signal.SIGPROF, False)
+        return True
+
+    def triggerFilePath(self):
+        return os.path.join(os.path.dirname(ba.server.LOG_PATH), 'profile_{0}'.format(self.daemon_name))
+
+    def poll(self):
+        """
+        called once per daemon cycle (tracing flush), starts sampling if the trigger file exists and
+        writes the results once the deadline passed, whether SIGPROF noticed it or the daemon used no CPU since
+        """
+        if self.stop_time is not None:
+            if self.finished or time.time() >= self.stop_time:
+                self.stop()
+            return
+
+        trigger_file_path = self.triggerFilePath()
+        if not os.path.exists(trigger_file_path):
+            return
+        duration = PROFILER_DURATION
+        try:
+            with open(trigger_file_path, 'r') as trigger_file:
+                trigger_content = trigger_file.read().strip()
+            if trigger_content:
+                duration = float(trigger_content)
+            os.remove(trigger_file_path)
+        except (IOError, OSError, ValueError) as error:
+            logger.warning("invalid profiler trigger {0}: {1}".format(trigger_file_path, str(error)))
+        self.start(duration)
+
+    def start(self, duration=PROFILER_DURATION):
+        if self.stop_time is not None:
+            return
+        logger.info("profiling {0} for {1}s".format(self.daemon_name, duration))
+        self._arm(duration)
+
+    def _arm(self, duration):
+        self.samples = {}
+        self.sample_count = 0
+        self.finished = False
+        self.stop_time = time.time() + duration
+        signal.setitimer(signal.ITIMER_PROF, PROFILER_INTERVAL, PROFILER_INTERVAL)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        self.stop_time = None
+        self.finished = False
+        try:
+            self._writeResults()
+        except (IOError, OSError) as error:
+            logger.error("can not write profile of {0}: {1}".format(self.daemon_name, str(error)))
+        self.samples = {}
+
+    def _onStartSignal(self, signum, frame):
+        # no logging in a signal handler, it may have interrupted a log call
+        if self.stop_time is None:
+            self._arm(PROFILER_DURATION)
+
+    def _onSample(self, signum, frame):
+        if self.stop_time is None or self.finished:
+            return
+        if time.time() >= self.stop_time:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            self.finished = True
+            return
+
+        # threading.enumerate() takes a lock the interrupted code may hold, _active is read without it
+        threads = threading._active
+        current_thread_id = threading.current_thread().ident
+        for thread_id, thread_frame in sys._current_frames().iteritems():
+            if thread_id == current_thread_id:
+                # the handler runs on top of the interrupted frame
+                thread_frame = frame
+            stack = []
+            while thread_frame is not None:
+                stack.append(_frameName(thread_frame))
+                thread_frame = thread_frame.f_back
+            thread = threads.get(thread_id)
+            stack.append(thread.name if thread is not None else 'thread-{0}'.format(thread_id))
+            stack.reverse()
+            collapsed_stack = ';'.join(stack)
+            self.samples[collapsed_stack] = self.samples.get(collapsed_stack, 0) + 1
+        self.sample_count = self.sample_count + 1
+
+    def _writeResults(self):
+        output_path = os.path.join(os.path.dirname(ba.server.LOG_PATH),
+                                   'profile_{0}_{1}'.format(self.daemon_name, time.strftime('%Y%m%d_%H%M%S')))
+
+        with open(output_path + '.collapsed', 'w') as collapsed_file:
+            for collapsed_stack, samples_count in sorted(self.samples.iteritems()):
+                collapsed_file.write('{0} {1}\n'.format(collapsed_stack, samples_count))
+
+        total_samples = sum(self.samples.itervalues())
+        self_samples = {}
+        inclusive_samples = {}
+        for collapsed_stack, samples_count in self.samples.iteritems():
+            stack = collapsed_stack.split(';')
+            self_samples[stack[-1]] = self_samples.get(stack[-1], 0) + samples_count
+            for function_name in set(stack):
+                inclusive_samples[function_name] = inclusive_samples.get(function_name, 0) + samples_count
+
+        lines = ['{0} samples every {1}s of CPU time, {2} thread stacks'.format(self.sample_count, PROFILER_INTERVAL,
+                                                                                 total_samples),
+                 '',
+                 '{0:>8} {1:>8} {2:>8}  {3}'.format('self %', 'total %', 'samples', 'function'),
+                 ]
+        top_functions = sorted(inclusive_samples, key=lambda function_name: (-self_samples.get(function_name, 0),
+                                                                             -inclusive_samples[function_name]))
+        for function_name in top_functions[:PROFILER_TOP_FUNCTIONS]:
+            lines.append('{0:>8.1f} {1:>8.1f} {2:>8}  {3}'.format(
+                100.0 * self_samples.get(function_name, 0) / max(total_samples, 1),
+                100.0 * inclusive_samples[function_name] / max(total_samples, 1),
+                self_samples.get(function_name, 0),
+                function_name))
+        with open(output_path + '.top.txt', 'w') as top_file:
+            top_file.write('\n'.join(lines) + '\n')
+
+        logger.info("profile of {0} written to {1}.collapsed, {2} samples".format(self.daemon_name, output_path,
+                                                                                   self.sample_count))
+
+
+profiler = SamplingProfiler()
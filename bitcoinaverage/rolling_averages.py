@@ -0,0 +1,156 @@
+import os
+import time
+import datetime
+import csv
+import collections
+import StringIO
+from decimal import Decimal, InvalidOperation
+import socket
+import logging
+from eventlet.green import urllib2
+from eventlet.green import httplib
+from eventlet.timeout import Timeout
+
+import bitcoinaverage as ba
+from bitcoinaverage.config import DEC_PLACES, CURRENCY_LIST, API_CALL_TIMEOUT_THRESHOLD, API_REQUEST_HEADERS
+from bitcoinaverage.exceptions import CallTimeoutException
+
+logger = logging.getLogger(__name__)
+
+HISTORY_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class RollingWindow(object):
+    """
+    Price samples of one series over a sliding time window with a running sum, average is O(1)
+    """
+
+    def __init__(self, window_seconds):
+        self.window_seconds = window_seconds
+        self.samples = collections.deque()
+        self.price_sum = DEC_PLACES
+
+    def append(self, sample_timestamp, price):
+        self.samples.append((sample_timestamp, price))
+        self.price_sum = self.price_sum + price
+
+    def expire(self, current_timestamp):
+        while len(self.samples) > 0 and current_timestamp - self.samples[0][0] >= self.window_seconds:
+            sample_timestamp, price = self.samples.popleft()
+            self.price_sum = self.price_sum - price
+
+    def last_timestamp(self):
+        if len(self.samples) == 0:
+            return 0
+        return self.samples[-1][0]
+
+    def average(self):
+        if len(self.samples) == 0:
+            return DEC_PLACES
+        return (self.price_sum / Decimal(len(self.samples))).quantize(DEC_PLACES)
+
+
+class RollingAverages(object):
+    """
+    Rolling windows keyed by currency code. Samples are taken at the same pace history_daemon
+    records them to per_minute_24h_* csv files, so the averages match the published history.
+    """
+
+    def __init__(self, window_seconds=86400, sample_interval=60*2):
+        self.window_seconds = window_seconds
+        self.sample_interval = sample_interval
+        self.windows = {}
+
+    def _window(self, currency_code):
+        if currency_code not in self.windows:
+            self.windows[currency_code] = RollingWindow(self.window_seconds)
+        return self.windows[currency_code]
+
+    def record(self, currency_code, price, current_timestamp):
+        window = self._window(currency_code)
+        window.expire(current_timestamp)
+        if current_timestamp - window.last_timestamp() > self.sample_interval:
+            #-60 same as in history_writers, timestamp points to the beginning of the current period
+            window.append(current_timestamp - 60, price)
+
+    def average(self, currency_code):
+        if currency_code not in self.windows:
+            return DEC_PLACES
+        return self.windows[currency_code].average()
+
+    def series(self, currency_code, since_timestamp):
+        """
+        [(sample timestamp, price)] of samples taken since since_timestamp, oldest first
+        """
+        if currency_code not in self.windows:
+            return []
+        series = []
+        for sample_timestamp, price in reversed(self.windows[currency_code].samples):
+            if sample_timestamp < since_timestamp:
+                break
+            series.append((sample_timestamp, price))
+        series.reverse()
+        return series
+
+    def load_csv(self, currency_code, csv_content, current_timestamp):
+        window = RollingWindow(self.window_seconds)
+        csvreader = csv.reader(StringIO.StringIO(csv_content), delimiter=',')
+        header_passed = False
+        for row in csvreader:
+            if not header_passed:
+                header_passed = True
+                continue
+            try:
+                sample_timestamp = time.mktime(datetime.datetime.strptime(row[0], HISTORY_DATETIME_FORMAT).timetuple())
+                price = Decimal(row[len(row)-1])
+            except (IndexError, ValueError, InvalidOperation):
+                continue
+            window.append(sample_timestamp, price)
+        window.expire(current_timestamp)
+        self.windows[currency_code] = window
+
+
+prices_24h = RollingAverages()
+global_prices_24h = RollingAverages()
+
+
+def _read_history_csv(currency_code, history_file_name):
+    history_file_path = os.path.join(ba.server.HISTORY_DOCUMENT_ROOT, currency_code, history_file_name)
+    if os.path.exists(history_file_path):
+        with open(history_file_path, 'rb') as history_file:
+            return history_file.read()
+
+    # history_daemon may run on a separate server, fall back to its web API
+    history_file_url = "{0}/{1}".format(
+        getattr(ba.server, "API_INDEX_URL_HISTORY_OVERRIDE", ba.server.API_INDEX_URL_HISTORY) + currency_code,
+        history_file_name)
+    try:
+        with Timeout(API_CALL_TIMEOUT_THRESHOLD, CallTimeoutException):
+            return urllib2.urlopen(urllib2.Request(url=history_file_url, headers=API_REQUEST_HEADERS)).read()
+    except (
+            ValueError,
+            socket.error,
+            urllib2.URLError,
+            httplib.BadStatusLine,
+            CallTimeoutException) as error:
+        logger.error("can not get history data from {0}: {1}".format(history_file_url, str(error)))
+        return None
+
+
+def rebuild_from_history():
+    current_timestamp = int(time.time())
+    for currency_code in CURRENCY_LIST:
+        csv_content = _read_history_csv(currency_code, 'per_minute_24h_sliding_window.csv')
+        if csv_content is not None:
+            prices_24h.load_csv(currency_code, csv_content, current_timestamp)
+        csv_content = _read_history_csv(currency_code, 'per_minute_24h_global_average_sliding_window.csv')
+        if csv_content is not None:
+            global_prices_24h.load_csv(currency_code, csv_content, current_timestamp)
+
+
+def record_cycle(calculated_average_rates, calculated_global_average_rates, current_timestamp):
+    for currency_code in CURRENCY_LIST:
+        if currency_code in calculated_average_rates:
+            prices_24h.record(currency_code, calculated_average_rates[currency_code]['last'], current_timestamp)
+        if currency_code in calculated_global_average_rates:
+            global_prices_24h.record(currency_code, calculated_global_average_rates[currency_code]['last'], current_timestamp)
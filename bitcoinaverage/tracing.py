@@ -0,0 +1,144 @@
+import os
+import time
+import logging
+
+import bitcoinaverage as ba
+from bitcoinaverage.config import TRACE_LOG_MAX_SIZE
+from bitcoinaverage.profiler import profiler
+
+logger = logging.getLogger(__name__)
+
+
+class Span(object):
+    """
+    Timed stage of a daemon cycle, use through Tracer.span as a context manager
+    """
+    __slots__ = ('tracer', 'name', 'labels', 'start_time', 'children_seconds', 'seconds')
+
+    def __init__(self, tracer, name, labels):
+        self.tracer = tracer
+        self.name = name
+        self.labels = labels
+        self.start_time = 0
+        self.children_seconds = 0
+        self.seconds = 0
+
+    def __enter__(self):
+        self.tracer.stack.append(self)
+        self.start_time = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.seconds = time.time() - self.start_time
+        self.tracer.spanDone(self)
+        return False
+
+
+class Tracer(object):
+    """
+    Aggregates nested span durations in memory. Every flush rewrites the daemon metrics file in
+    Prometheus text format and, when TRACE_LOG_PATH is set, appends stacks spent since the previous
+    flush in collapsed format (as read by flamegraph.pl). Recording a span costs two time() calls
+    and a dict update, so it stays enabled in production.
+    """
+
+    def __init__(self):
+        self.daemon_name = None
+        self.stack = []
+        self.stages = {}  # (stage path, labels) -> [calls, seconds total, last seconds, max seconds]
+        self.collapsed_stacks = {}  # collapsed stack -> self seconds since last flush
+        self.values = {}  # (metric name, labels) -> (metric type, value), metrics reported by daemons
+
+    def configure(self, daemon_name):
+        self.daemon_name = daemon_name
+
+    def span(self, name, **labels):
+        return Span(self, name, tuple(sorted(labels.iteritems())))
+
+    def spanDone(self, span):
+        seconds = span.seconds
+        path = '/'.join(stack_span.name for stack_span in self.stack)
+        self.stack.pop()
+        if len(self.stack) > 0:
+            self.stack[-1].children_seconds = self.stack[-1].children_seconds + seconds
+
+        stage = self.stages.get((path, span.labels))
+        if stage is None:
+            self.stages[(path, span.labels)] = [1, seconds, seconds, seconds]
+        else:
+            stage[0] = stage[0] + 1
+            stage[1] = stage[1] + seconds
+            stage[2] = seconds
+            if seconds > stage[3]:
+                stage[3] = seconds
+        self.collapsed_stacks[path] = self.collapsed_stacks.get(path, 0) + seconds - span.children_seconds
+
+    def setValue(self, name, value, metric_type='gauge', **labels):
+        self.values[(name, tuple(sorted(labels.iteritems())))] = (metric_type, value)
+
+    def flush(self):
+        # cycle boundary of a daemon, cheap place to look for a profiler trigger file
+        profiler.poll()
+        if self.daemon_name is None:
+            self.collapsed_stacks = {}
+            return
+
+        try:
+            self._writeMetrics()
+            if getattr(ba.server, 'TRACE_LOG_PATH', ''):
+                self._writeTraceLog()
+        except (IOError, OSError) as error:
+            logger.error("can not write metrics of {0}: {1}".format(self.daemon_name, str(error)))
+        self.collapsed_stacks = {}
+
+    def _formatLabels(self, labels):
+        labels = (('daemon', self.daemon_name),) + labels
+        return ','.join('{0}="{1}"'.format(label_name, str(label_value).replace('\\', '\\\\').replace('"', '\\"'))
+                        for label_name, label_value in labels)
+
+    def _writeMetrics(self):
+        lines = []
+        stage_metrics = (('ba_stage_calls_total', 'counter', 0, 'Times a daemon stage ran'),
+                         ('ba_stage_seconds_total', 'counter', 1, 'Seconds spent in a daemon stage'),
+                         ('ba_stage_last_seconds', 'gauge', 2, 'Seconds spent in the last run of a daemon stage'),
+                         ('ba_stage_max_seconds', 'gauge', 3, 'Longest run of a daemon stage since start'),
+                         )
+        for metric_name, metric_type, index, metric_help in stage_metrics:
+            lines.append('# HELP {0} {1}'.format(metric_name, metric_help))
+            lines.append('# TYPE {0} {1}'.format(metric_name, metric_type))
+            for (path, labels), stage in sorted(self.stages.iteritems()):
+                lines.append('{0}{{{1}}} {2}'.format(metric_name,
+                                                     self._formatLabels((('stage', path),) + labels),
+                                                     repr(float(stage[index]))))
+
+        metric_types = {}
+        for (metric_name, labels), (metric_type, value) in sorted(self.values.iteritems()):
+            if metric_name not in metric_types:
+                metric_types[metric_name] = metric_type
+                lines.append('# TYPE {0} {1}'.format(metric_name, metric_type))
+            lines.append('{0}{{{1}}} {2}'.format(metric_name, self._formatLabels(labels), repr(float(value))))
+
+        metrics_file_path = os.path.join(ba.server.METRICS_PATH, '{0}.prom'.format(self.daemon_name))
+        if not os.path.exists(ba.server.METRICS_PATH):
+            os.makedirs(ba.server.METRICS_PATH)
+        # node_exporter textfile collector may read it any time, so it is replaced atomically
+        with open(metrics_file_path + '.tmp', 'w') as metrics_file:
+            metrics_file.write('\n'.join(lines) + '\n')
+        os.rename(metrics_file_path + '.tmp', metrics_file_path)
+
+    def _writeTraceLog(self):
+        trace_log_path = ba.server.TRACE_LOG_PATH
+        if os.path.exists(trace_log_path) and os.path.getsize(trace_log_path) > TRACE_LOG_MAX_SIZE:
+            os.rename(trace_log_path, trace_log_path + '.1')
+
+        lines = []
+        for path, seconds in sorted(self.collapsed_stacks.iteritems()):
+            microseconds = int(seconds * 1000000)
+            if microseconds > 0:
+                lines.append('{0};{1} {2}\n'.format(self.daemon_name, path.replace('/', ';'), microseconds))
+        with open(trace_log_path, 'a') as trace_log_file:
+            trace_log_file.writelines(lines)
+
+
+tracer = Tracer()
+span = tracer.span
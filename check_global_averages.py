@@ -0,0 +1,182 @@
+#!/usr/bin/python2.7
+"""
+Checks api_calculations.calculateAllGlobalAverages, which sums the weighted averages of CURRENCY_LIST once
+and scales them by every fiat rate, against the cross-rate-per-pair computation it replaced, on api_daemon
+cycles recorded to API_CYCLE_LOG_PATH (see server.py.dist) or, with --synthetic, on exchange and fiat rates
+generated as by benchmark_calculations.py for every combination of fiat currency count and missing share.
+No redis or network is used. Prints a JSON report, exits with 1 if any quantized last/ask/bid differs.
+
+usage: check_global_averages.py <cycle log> [--limit N]
+       check_global_averages.py --synthetic [--fiat-counts 21,50,170,500] [--missing-shares 0,0.05,0.2,0.5]
+                                [--exchanges N] [--seeds N]
+"""
+import sys
+import json
+import argparse
+import logging
+from decimal import Decimal
+
+from bitcoinaverage import api_calculations
+from bitcoinaverage import fiat_rates
+from bitcoinaverage.config import CURRENCY_LIST, DEC_PLACES
+from bitcoinaverage.cycle_log import readCycles
+from bitcoinaverage.incremental_calculations import ExchangesTracker, IncrementalCalculator
+from benchmark_calculations import generateExchangesRates, generateFiatRates, SyntheticUniverse
+
+logger = logging.getLogger("check_global_averages")
+
+MAX_REPORTED_MISMATCHES = 20
+SYNTHETIC_DENSITY = 0.5
+
+
+def referenceGlobalAverages(calculated_average_rates, total_currency_volumes, fiat_currencies_list):
+    """
+    global averages as calculateAllGlobalAverages computed them before it was factorized
+    """
+    def getCurrencyCrossRate(currency_from, currency_to):
+        if currency_from == currency_to:
+            return Decimal(1)
+
+        rate_from = Decimal(fiat_currencies_list[currency_from]['rate'])
+        rate_to = Decimal(fiat_currencies_list[currency_to]['rate'])
+        return (rate_from / rate_to)
+
+    global_volume = DEC_PLACES
+    for currency in CURRENCY_LIST:
+        global_volume = global_volume + total_currency_volumes[currency]
+
+    global_volume_percents = {}
+    for currency in CURRENCY_LIST:
+        global_volume_percents[currency] = (total_currency_volumes[currency] / global_volume * Decimal(100)).quantize(DEC_PLACES)
+
+    global_averages = {}
+    for currency_local in fiat_currencies_list:
+        global_averages[currency_local] = {'last': DEC_PLACES,
+                                           'ask': DEC_PLACES,
+                                           'bid': DEC_PLACES,
+                                           }
+        for currency_to_convert in CURRENCY_LIST:
+            for key in ('last', 'ask', 'bid'):
+                global_averages[currency_local][key] = (global_averages[currency_local][key]
+                                                        + (calculated_average_rates[currency_to_convert][key]
+                                                           * global_volume_percents[currency_to_convert] / Decimal(100)
+                                                           * getCurrencyCrossRate(currency_local, currency_to_convert)))
+        for key in ('last', 'ask', 'bid'):
+            global_averages[currency_local][key] = global_averages[currency_local][key].quantize(DEC_PLACES)
+    return global_averages, global_volume_percents
+
+
+def compareGlobalAverages(calculated_average_rates, total_currency_volumes, case, mismatches):
+    """
+    appends differences of both computations for the current fiat_rates.cache to mismatches,
+    returns the number of values compared
+    """
+    global_averages, global_volume_percents = api_calculations.calculateAllGlobalAverages(
+        calculated_average_rates, total_currency_volumes)
+    reference_averages, reference_volume_percents = referenceGlobalAverages(
+        calculated_average_rates, total_currency_volumes, fiat_rates.cache.currencies)
+
+    values_count = 0
+    if global_volume_percents != reference_volume_percents:
+        mismatches.append({'case': case, 'currency': None, 'key': 'volume_percents'})
+    for currency_local, reference_average in reference_averages.iteritems():
+        for key, reference_value in reference_average.iteritems():
+            values_count = values_count + 1
+            value = global_averages.get(currency_local, {}).get(key)
+            if value != reference_value:
+                mismatches.append({'case': case,
+                                   'currency': currency_local,
+                                   'key': key,
+                                   'value': str(value),
+                                   'reference': str(reference_value),
+                                   })
+    return values_count
+
+
+def checkCycleLog(cycle_log, limit, mismatches):
+    """
+    returns (cycles, values) compared on cycles of the log
+    """
+    exchanges_tracker = ExchangesTracker()
+    calculator = IncrementalCalculator()
+    cycles_count = 0
+    values_count = 0
+    for current_time, raw_exchanges, exchanges_ignored, fiat_currencies in readCycles(cycle_log):
+        if fiat_currencies is not None:
+            fiat_rates.cache.update(fiat_currencies, persist=False)
+        dirty_currencies = exchanges_tracker.update(raw_exchanges)
+        calculator.update(exchanges_tracker.exchangeRecords(raw_exchanges), dirty_currencies, int(current_time))
+        values_count = values_count + compareGlobalAverages(calculator.calculated_average_rates,
+                                                            calculator.total_currency_volumes,
+                                                            current_time, mismatches)
+        cycles_count = cycles_count + 1
+        if cycles_count == limit:
+            break
+    return cycles_count, values_count
+
+
+def checkSynthetic(fiat_counts, missing_shares, exchanges_count, seeds, mismatches):
+    """
+    returns (cases, values) compared on generated rates, CURRENCY_LIST quoted by exchanges_count exchanges
+    """
+    cases_count = 0
+    values_count = 0
+    for fiat_count in fiat_counts:
+        for missing_share in missing_shares:
+            for seed in xrange(1, seeds + 1):
+                exchanges_rates = generateExchangesRates(exchanges_count, CURRENCY_LIST, SYNTHETIC_DENSITY,
+                                                         missing_share, seed)
+                fiat_currencies = generateFiatRates(CURRENCY_LIST, fiat_count, seed)
+                with SyntheticUniverse(exchanges_rates, CURRENCY_LIST, fiat_currencies):
+                    total_currency_volumes, total_currency_volumes_ask, total_currency_volumes_bid = \
+                        api_calculations.calculateTotalVolumes(exchanges_rates, CURRENCY_LIST)
+                    calculated_volumes = api_calculations.calculateRelativeVolumes(
+                        exchanges_rates, total_currency_volumes, total_currency_volumes_ask,
+                        total_currency_volumes_bid, CURRENCY_LIST)
+                    calculated_average_rates = api_calculations.calculateAverageRates(
+                        exchanges_rates, calculated_volumes, CURRENCY_LIST)
+                    case = '{0}x{1}x{2} missing {3} seed {4}'.format(exchanges_count, len(CURRENCY_LIST),
+                                                                      fiat_count, missing_share, seed)
+                    values_count = values_count + compareGlobalAverages(calculated_average_rates,
+                                                                        total_currency_volumes, case, mismatches)
+                cases_count = cases_count + 1
+    return cases_count, values_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='check factorized global averages against the per pair computation')
+    parser.add_argument('cycle_log', nargs='?', help='gzip compressed cycle log written by api_daemon')
+    parser.add_argument('--limit', type=int, default=0, help='check only first N cycles')
+    parser.add_argument('--synthetic', action='store_true', help='check generated rates instead of a cycle log')
+    parser.add_argument('--fiat-counts', default='21,50,170,500',
+                        help='comma separated fiat currency counts of --synthetic, default %(default)s')
+    parser.add_argument('--missing-shares', default='0,0.05,0.2,0.5',
+                        help='comma separated shares of missing (None) rates and volumes, default %(default)s')
+    parser.add_argument('--exchanges', type=int, default=50, help='exchanges of --synthetic, default %(default)s')
+    parser.add_argument('--seeds', type=int, default=5, help='seeds of every --synthetic case, default %(default)s')
+    args = parser.parse_args()
+    if args.synthetic == (args.cycle_log is not None):
+        parser.error('give either a cycle log or --synthetic')
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    mismatches = []
+    if args.synthetic:
+        cases_count, values_count = checkSynthetic([int(value) for value in args.fiat_counts.split(',')],
+                                                   [float(value) for value in args.missing_shares.split(',')],
+                                                   args.exchanges, args.seeds, mismatches)
+        report = {'cases': cases_count}
+    else:
+        cases_count, values_count = checkCycleLog(args.cycle_log, args.limit, mismatches)
+        report = {'cycles': cases_count}
+
+    report.update({'values': values_count,
+                   'mismatches': len(mismatches),
+                   'first_mismatches': mismatches[:MAX_REPORTED_MISMATCHES],
+                   })
+    print json.dumps(report, indent=2, sort_keys=True, separators=(',', ': '))
+    return 1 if len(mismatches) > 0 or cases_count == 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
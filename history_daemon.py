@@ -13,10 +13,12 @@ import logging
 import bitcoinaverage as ba
 from bitcoinaverage.config import HISTORY_QUERY_FREQUENCY, CURRENCY_LIST
 from bitcoinaverage import history_writers
+from bitcoinaverage import tracing
 
 logger = logging.getLogger("history_daemon")
 logging.getLogger("requests.packages.urllib3.connectionpool").setLevel(logging.WARNING)
 logger.info("script started")
+tracing.tracer.configure('history_daemon')
 
 
 for currency_code in CURRENCY_LIST:
@@ -27,8 +29,9 @@ while True:
     ticker_url = ba.server.API_INDEX_URL+'all'
     fiat_data_url = ba.server.API_INDEX_URL+'fiat_data'
     try:
-        current_data_all = requests.get(ticker_url, headers=ba.config.API_REQUEST_HEADERS).json()
-        fiat_data_all = requests.get(fiat_data_url, headers=ba.config.API_REQUEST_HEADERS).json()
+        with tracing.span('fetch_api'):
+            current_data_all = requests.get(ticker_url, headers=ba.config.API_REQUEST_HEADERS).json()
+            fiat_data_all = requests.get(fiat_data_url, headers=ba.config.API_REQUEST_HEADERS).json()
     except (simplejson.decoder.JSONDecodeError, requests.exceptions.ConnectionError), err:
         logger.warning("can not get API data: {0}".format(str(err)))
         time.sleep(10)
@@ -39,17 +42,25 @@ while True:
     current_data_datetime = datetime.datetime.strptime(current_data_datetime, '%a, %d %b %Y %H:%M:%S')
     current_data_timestamp = int((current_data_datetime - datetime.datetime(1970, 1, 1)).total_seconds())
 
-    for currency_code in CURRENCY_LIST:
-        try:
-            history_writers.write_24h_csv(currency_code, current_data_all[currency_code]['averages'], current_data_timestamp)
-            history_writers.write_1mon_csv(currency_code, current_data_timestamp)
-            history_writers.write_forever_csv(currency_code, current_data_all[currency_code]['averages']['total_vol'], current_data_timestamp)
-            history_writers.write_volumes_csv(currency_code, current_data_all[currency_code], current_data_timestamp)
-
-            history_writers.write_24h_global_average_csv(fiat_data_all, current_data_all,  currency_code, current_data_timestamp)
-            history_writers.write_24h_global_average_short_csv(current_data_all,  currency_code, current_data_timestamp)
-        except KeyError, err:
-            logger.warning(str(err))
+    with tracing.span('write_history'):
+        for currency_code in CURRENCY_LIST:
+            try:
+                with tracing.span('write_24h_csv', currency=currency_code):
+                    history_writers.write_24h_csv(currency_code, current_data_all[currency_code]['averages'], current_data_timestamp)
+                with tracing.span('write_1mon_csv', currency=currency_code):
+                    history_writers.write_1mon_csv(currency_code, current_data_timestamp)
+                with tracing.span('write_forever_csv', currency=currency_code):
+                    history_writers.write_forever_csv(currency_code, current_data_all[currency_code]['averages']['total_vol'], current_data_timestamp)
+                with tracing.span('write_volumes_csv', currency=currency_code):
+                    history_writers.write_volumes_csv(currency_code, current_data_all[currency_code], current_data_timestamp)
+
+                with tracing.span('write_24h_global_average_csv', currency=currency_code):
+                    history_writers.write_24h_global_average_csv(fiat_data_all, current_data_all,  currency_code, current_data_timestamp)
+                with tracing.span('write_24h_global_average_short_csv', currency=currency_code):
+                    history_writers.write_24h_global_average_short_csv(current_data_all,  currency_code, current_data_timestamp)
+            except KeyError, err:
+                logger.warning(str(err))
+    tracing.tracer.flush()
 
     current_time = time.time()
     timestamp = email.utils.formatdate(current_time)
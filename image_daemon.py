@@ -6,6 +6,7 @@ import requests
 import time
 from PIL import Image, ImageDraw, ImageFont
 from bitcoinaverage.server import FONT_PATH, WWW_DOCUMENT_ROOT, API_INDEX_URL
+from bitcoinaverage.profiler import profiler
 try:
     from cStringIO import StringIO
 except:
@@ -71,4 +72,5 @@ while True:
     pil_image("eur")
     pil_image("gbp")
 
+    profiler.poll()
     time.sleep(60*5)
@@ -12,6 +12,7 @@ import StringIO
 from email import Utils
 from bitcoinaverage.server import MONITOR_RECIPIENT_EMAIL, MONITOR_SENDER_EMAIL
 from bitcoinaverage.server import API_INDEX_URL, API_INDEX_URL_HISTORY
+from bitcoinaverage.profiler import profiler
 
 ticker_URL = API_INDEX_URL + "ticker/USD"
 history_URL = API_INDEX_URL_HISTORY + "USD/per_minute_24h_sliding_window.csv"
@@ -117,5 +118,6 @@ while True:
     timestamp = Utils.formatdate(time.time())
     print timestamp + " - monitor_daemon.py"
 
+    profiler.poll()
     time.sleep(120)
     
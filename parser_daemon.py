@@ -7,11 +7,13 @@ import simplejson as json
 import eventlet
 
 from bitcoinaverage import api_parsers
+from bitcoinaverage import tracing
 from bitcoinaverage.config import API_QUERY_FREQUENCY, EXCHANGE_LIST
 
 logger = logging.getLogger("parser_daemon")
 
 logger.info("started API parser daemon")
+tracing.tracer.configure('parser_daemon')
 
 red = redis.StrictRedis(host="localhost", port=6379, db=0)
 red.delete("ba:exchanges", "ba:exchanges_ignored")  # Reset
@@ -20,7 +22,10 @@ pool = eventlet.GreenPool()
 queue = eventlet.Queue()
 
 def worker(exchange_name, q):
+    # workers run concurrently, so exchange calls are not spans of the cycle stack
+    call_start_time = time.time()
     result = api_parsers.callAPI(exchange_name)
+    tracing.tracer.setValue('ba_parser_call_last_seconds', time.time() - call_start_time, exchange=exchange_name)
     q.put(result)
 
 for exchange_name in EXCHANGE_LIST:
@@ -30,21 +35,25 @@ while True:
     start_time = time.time()
 
     results = []
-    while not queue.empty():
-        results.append(queue.get())
-
-    for exchange_name, exchange_data, exchange_ignore_reason in results:
-        if exchange_ignore_reason is None:
-            red.hset("ba:exchanges",
-                     exchange_name,
-                     json.dumps(exchange_data, use_decimal=True))
-            red.hdel("ba:exchanges_ignored", exchange_name)
-        else:
-            red.hset("ba:exchanges_ignored",
-                     exchange_name,
-                     exchange_ignore_reason)
-            red.hdel("ba:exchanges", exchange_name)
-        pool.spawn_n(worker, exchange_name, queue)
+    with tracing.span('collect_results'):
+        while not queue.empty():
+            results.append(queue.get())
+
+    with tracing.span('write_redis'):
+        for exchange_name, exchange_data, exchange_ignore_reason in results:
+            if exchange_ignore_reason is None:
+                red.hset("ba:exchanges",
+                         exchange_name,
+                         json.dumps(exchange_data, use_decimal=True))
+                red.hdel("ba:exchanges_ignored", exchange_name)
+            else:
+                red.hset("ba:exchanges_ignored",
+                         exchange_name,
+                         exchange_ignore_reason)
+                red.hdel("ba:exchanges", exchange_name)
+            pool.spawn_n(worker, exchange_name, queue)
+    tracing.tracer.setValue('ba_parser_results', len(results))
+    tracing.tracer.flush()
     logger.info("saved {0} results".format(len(results)))
 
     cycle_time = time.time() - start_time
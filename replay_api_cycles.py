@@ -0,0 +1,109 @@
+#!/usr/bin/python2.7
+"""
+Replays api_daemon cycles recorded to API_CYCLE_LOG_PATH (see server.py.dist) through the calculation
+and API writers pipeline, into a scratch document root, without redis, network or sleeping between cycles.
+Prints a JSON report with throughput of every pipeline stage.
+
+usage: replay_api_cycles.py <cycle log> [--document-root DIR] [--limit N] [--serve HOST:PORT]
+
+With --serve the documents are kept in memory and served over HTTP after the replay, until interrupted,
+for load testing of api_server.py.
+"""
+import os
+import sys
+import time
+import json
+import argparse
+import tempfile
+import logging
+
+import bitcoinaverage as ba
+from bitcoinaverage import fiat_rates
+from bitcoinaverage import api_files
+from bitcoinaverage import api_server
+import bitcoinaverage.helpers as helpers
+from bitcoinaverage.api_pipeline import APIPipeline
+from bitcoinaverage.cycle_log import readCycles
+
+logger = logging.getLogger("replay_api_cycles")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='replay recorded api_daemon cycles')
+    parser.add_argument('cycle_log', help='gzip compressed cycle log written by api_daemon')
+    parser.add_argument('--document-root', help='API document root to write to, temporary directory if not set')
+    parser.add_argument('--limit', type=int, default=0, help='replay only first N cycles')
+    parser.add_argument('--serve', help='keep documents in memory and serve them on HOST:PORT after the replay')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    api_document_root = args.document_root or tempfile.mkdtemp(prefix='ba_replay_')
+    ba.server.API_DOCUMENT_ROOT = api_document_root
+    ba.server.HISTORY_DOCUMENT_ROOT = os.path.join(api_document_root, 'history')
+    ba.server.WWW_DOCUMENT_ROOT = os.path.join(api_document_root, 'www')
+    if not os.path.exists(ba.server.WWW_DOCUMENT_ROOT):
+        os.makedirs(ba.server.WWW_DOCUMENT_ROOT)
+
+    if args.serve:
+        api_files.writer.store = api_server.store
+
+    helpers.write_exchanges_metadata()
+    pipeline = APIPipeline(api_document_root)
+    stage_totals = dict((stage_name, 0.0) for stage_name, priority, tier in APIPipeline.STAGES)
+    cycles_count = 0
+    start_time = time.time()
+    for current_time, raw_exchanges, exchanges_ignored, fiat_currencies in readCycles(args.cycle_log):
+        if fiat_currencies is not None:
+            fiat_rates.cache.update(fiat_currencies, persist=False)
+            helpers.write_api_index_files()
+
+        pipeline.run_cycle(raw_exchanges, exchanges_ignored, current_time)
+        for stage_name, stage_time in pipeline.stage_timings.iteritems():
+            stage_totals[stage_name] = stage_totals[stage_name] + stage_time
+
+        cycles_count = cycles_count + 1
+        if cycles_count == args.limit:
+            break
+    total_time = time.time() - start_time
+
+    report = {'cycles': cycles_count,
+              'document_root': api_document_root,
+              'seconds': total_time,
+              'cycles_per_second': cycles_count / total_time if total_time > 0 else 0,
+              'stages': {},
+              'overruns': pipeline.metrics['overruns'],
+              'files_written': pipeline.metrics['files_written'],
+              'files_skipped': pipeline.metrics['files_skipped'],
+              'syscalls': pipeline.metrics['syscalls'],
+              'syscalls_per_cycle': sum(pipeline.metrics['syscalls'].itervalues()) / max(cycles_count, 1),
+              }
+    for stage_name, stage_time in stage_totals.iteritems():
+        report['stages'][stage_name] = {'seconds': stage_time,
+                                        'cycles_per_second': cycles_count / stage_time if stage_time > 0 else 0,
+                                        'deferred': pipeline.metrics['deferred'][stage_name],
+                                        'forced': pipeline.metrics['forced'][stage_name],
+                                        }
+    report['encodings'] = {}
+    for api_file_name, sizes in api_files.writer.encodingSavings().iteritems():
+        report['encodings'][api_file_name] = dict(sizes)
+        for encoding in ('gzip', 'br'):
+            if encoding in sizes and sizes['identity'] > 0:
+                report['encodings'][api_file_name][encoding + '_saved_percent'] = round(
+                    100.0 * (sizes['identity'] - sizes[encoding]) / sizes['identity'], 1)
+        if 'br' in sizes and sizes['gzip'] > 0:
+            report['encodings'][api_file_name]['br_smaller_than_gzip_percent'] = round(
+                100.0 * (sizes['gzip'] - sizes['br']) / sizes['gzip'], 1)
+    print json.dumps(report, indent=2, sort_keys=True, separators=(',', ': '))
+    sys.stdout.flush()
+
+    if args.serve:
+        try:
+            api_server.serve(args.serve)
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -9,6 +9,7 @@ import requests
 
 from bitcoinaverage.server import API_INDEX_URL
 from bitcoinaverage.twitter_config import api
+from bitcoinaverage.profiler import profiler
 
 logger = logging.getLogger("twitter_daemon")
 
@@ -55,4 +56,5 @@ while True:
     else:
         oldprice = newprice
 
+    profiler.poll()
     time.sleep(3600)
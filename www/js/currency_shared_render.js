@@ -248,9 +248,9 @@ var calc_bitcoinInputKeyup = function(e){
 var renderLegendForExtendedCurrencyList = function(currencyCode){
 
     $('.highcharts-container').hide();
-    $.getJSON(config.apiIndexUrl+'ticker/global/all', function(data){
+    $.getJSON(config.apiIndexUrl+'bundle/'+currencyCode, function(bundle){
 
-        var currencyCodeData =  adjustScale (data[currencyCode], config.scaleDivizer);
+        var currencyCodeData =  adjustScale (bundle['global_averages'], config.scaleDivizer);
 
         $('.legend-curcode').text(currencyCode);
 
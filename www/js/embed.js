@@ -39,8 +39,8 @@ var ba_widget = function (html_id, currency) {
 	self._protocol = window.location.protocol;
 	self._wrapper_id = html_id;
 	self._currencyCode = currency;
-	self._apiHistoryIndexUrl = 'https://api.bitcoinaverage.com/history/';
-	self._data24hURL = self._apiHistoryIndexUrl + self._currencyCode + '/per_minute_24h_sliding_window.csv';
+	self._apiIndexUrl = 'https://api.bitcoinaverage.com/';
+	self._bundleURL = self._apiIndexUrl + 'bundle/' + self._currencyCode;
 
 	self.init = function () {
 		// jQuery is required for different stuff
@@ -68,18 +68,6 @@ var ba_widget = function (html_id, currency) {
 		}
 	}
 
-	self._parseTimeStamp = function(dateString) {
-		var parts = dateString.split(' ');
-		var dateParts = parts[0].split('-');
-		if (typeof parts[1] != 'undefined') {
-			var timeParts = parts[1].split(':');
-		} else {
-			var timeParts = [0,0,0];
-		}
-		var result = Date.UTC(dateParts[0], dateParts[1]-1, dateParts[2], timeParts[0], timeParts[1], timeParts[2]);
-		return result;
-	}
-
 	self._template =
 		'<style>\
 			@import url(http://fonts.googleapis.com/css?family=Open+Sans:400,600,400italic,600italic&subset=latin,cyrillic-ext);\
@@ -168,21 +156,19 @@ var ba_widget = function (html_id, currency) {
 
 	self.updateData = function (highchart) {
 		var data = [];
-		self._ajaxCall(self._data24hURL, function (csv) {
-			$.each(csv.split('\n').slice(-60), function(i, line) {
-				var values = line.split(',');
-				if (i == 0 || line.length == 0 || values.length != 2) {
-					return;
-				}
-				data.push([
-					self._parseTimeStamp(values[0]),
-					parseFloat(values[1])
-				]);
+		self._ajaxCall(self._bundleURL, function (bundle) {
+			if (typeof bundle == 'string') {
+				bundle = JSON.parse(bundle);
+			}
+			// sparkline of the last hour, [unix time, price], currencies outside the main list have none
+			$.each(bundle['sparkline'] || [], function(i, sample) {
+				data.push([sample[0] * 1000, sample[1]]);
 			});
 			highchart.series[0].setData(data);
 
-			var value = data[data.length-1][1];
-			var integer = Math.floor(data[data.length-1][1]);
+			// currencies outside the main list have the global average only
+			var value = ('averages' in bundle) ? bundle['averages']['last'] : bundle['global_averages']['last'];
+			var integer = Math.floor(value);
 			var fraction = Math.round((value % 1)*100);
 			$('.ba-range-int').html(integer + ".");
 			if(fraction >= 10) {
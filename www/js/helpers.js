@@ -43,6 +43,126 @@ var adjustScale = function(apiResult, scaleDivizer){
     return adjustedApiResult;
 };
 
+// exchange rows of the lean API schema have no display_name and display_URL, they are in config.exchangesMetadata
+var withExchangeMetadata = function(exchangeName, exchangeData){
+    if (typeof exchangeData['display_name'] == 'undefined') {
+        var metadata = {};
+        if (typeof config.exchangesMetadata != 'undefined' && exchangeName in config.exchangesMetadata) {
+            metadata = config.exchangesMetadata[exchangeName];
+        }
+        exchangeData['display_name'] = metadata['display_name'] || exchangeName;
+        if (typeof metadata['display_URL'] != 'undefined') {
+            exchangeData['display_URL'] = metadata['display_URL'];
+        }
+    }
+    return exchangeData;
+};
+
+var sortedCopy = function(value){
+    if (!$.isPlainObject(value)) {
+        return value;
+    }
+    var keys = [];
+    for (var key in value) {
+        keys.push(key);
+    }
+    keys.sort();
+    var result = {};
+    for (var i = 0; i < keys.length; i++) {
+        result[keys[i]] = sortedCopy(value[keys[i]]);
+    }
+    return result;
+};
+
+// delta of the API (see README), removed key paths go first, then changes are merged in
+var applyDelta = function(apiDocument, delta){
+    for (var i = 0; i < delta.removed.length; i++) {
+        var path = delta.removed[i];
+        var parent = apiDocument;
+        for (var j = 0; j < path.length - 1 && $.isPlainObject(parent); j++) {
+            parent = parent[path[j]];
+        }
+        if ($.isPlainObject(parent)) {
+            delete parent[path[path.length - 1]];
+        }
+    }
+    var merge = function(target, changes){
+        for (var key in changes) {
+            var value = changes[key];
+            if ($.isPlainObject(value) && !$.isEmptyObject(value)) {
+                if (!$.isPlainObject(target[key])) {
+                    target[key] = {};
+                }
+                merge(target[key], value);
+            } else {
+                target[key] = value;
+            }
+        }
+    };
+    merge(apiDocument, delta.changes);
+    return apiDocument;
+};
+
+// Version probe of an API document (url under config.apiIndexUrl): <family>/version is fetched first, download
+// is called only when the data hash of the document changed since the last download, with a function to call
+// when it succeeded. Otherwise onUnchanged gets the probe, its timestamp is the one the document has now.
+var apiVersionHashes = {};
+var probeAPIVersion = function(url, download, onUnchanged){
+    var documentPath = url.slice(config.apiIndexUrl.length);
+    var versionUrl = config.apiIndexUrl + documentPath.slice(0, documentPath.lastIndexOf('/') + 1) + 'version';
+    if (window.XDomainRequest) {
+        download(function(){});
+        return;
+    }
+    $.getJSON(versionUrl, function(version){
+        var hash = version['documents'][documentPath];
+        if (typeof hash != 'undefined' && apiVersionHashes[documentPath] === hash) {
+            onUnchanged(version);
+            return;
+        }
+        download(function(){
+            apiVersionHashes[documentPath] = hash;
+        });
+    }).fail(function(){
+        download(function(){});
+    });
+};
+
+// Server-sent events of an API document (topic is its path, e.g. 'all' or 'ticker/USD') from config.apiStreamUrl,
+// callback gets the whole document on every update, like from polling. Returns false when streaming is not
+// available; when the stream keeps failing it is closed and onFailure is called, so the page can poll instead.
+var subscribeAPI = function(topic, callback, onFailure){
+    if (typeof config.apiStreamUrl == 'undefined' || config.apiStreamUrl == '' || typeof window.EventSource == 'undefined') {
+        return false;
+    }
+    var apiDocument = null;
+    var failures = 0;
+    var source = new EventSource(config.apiStreamUrl + '?topics=' + encodeURIComponent(topic));
+
+    source.addEventListener('snapshot', function(event){
+        apiDocument = JSON.parse(event.data)['snapshot'];
+        failures = 0;
+        callback(sortedCopy(apiDocument));
+    });
+    source.addEventListener('delta', function(event){
+        if (apiDocument === null) {
+            return;
+        }
+        apiDocument = applyDelta(apiDocument, JSON.parse(event.data)['delta']);
+        failures = 0;
+        // keys added by a delta would come last, pages expect them sorted as in the API
+        callback(sortedCopy(apiDocument));
+    });
+    source.onerror = function(){
+        failures++;
+        if (source.readyState == EventSource.CLOSED || failures >= 3) {
+            source.close();
+            onFailure();
+        }
+    };
+    return true;
+};
+
 var print_r=function(arr, do_alert, level) { var print_red_text = ""; if(!level) {level = 0;} var level_padding = ""; for(var j=0; j<level+1; j++) {level_padding += "    ";} if(typeof(arr) == 'object') { for(var item in arr) { var value = arr[item]; if(typeof(value) == 'object') { print_red_text += level_padding + "'" + item + "' :\n"; print_red_text += print_r(value,level+1); } else {print_red_text += level_padding + "'" + item + "' => \"" + value + "\"\n";} } } else {print_red_text = "===>"+arr+"<===("+typeof(arr)+")";} if(typeof do_alert == 'undefined'){alert(print_red_text);} return print_red_text;};
 jQuery.fn.selectText=function(){var doc=document,element=this[0],range,selection; if(doc.body.createTextRange){range=document.body.createTextRange();range.moveToElementText(element);range.select();}else if(window.getSelection){selection=window.getSelection();range=document.createRange();range.selectNodeContents(element);selection.removeAllRanges();selection.addRange(range);}};
 jQuery.fn.countObj=function(){var count=0;var obj=this[0];for(i in obj){if(obj.hasOwnProperty(i)){count++;}}return count;};
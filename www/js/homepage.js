@@ -465,7 +465,22 @@ $(function(){
 
     callAPI();
 
-    setInterval(callAPI, config.refreshRate);
+    var pollAPI = function(){
+        setInterval(function(){
+            probeAPIVersion(active_API_URL, function(downloaded){
+                callAPI(function(result, status, responseObj){
+                    downloaded();
+                    renderAll(result, status, responseObj);
+                });
+            }, function(version){
+                API_data['timestamp'] = version['timestamp'];
+                renderUpdateTime();
+            });
+        }, config.refreshRate);
+    };
+    if (!subscribeAPI('all', renderAll, pollAPI)) {
+        pollAPI();
+    }
     setInterval(renderUpdateTime, 5000);
 
     $('#legend-block').click(function(event){
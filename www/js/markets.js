@@ -205,7 +205,7 @@ var renderLegend = function(currencyCode){
 
     var index = 0;
     for(var exchange_name in currencyData.exchanges){
-        exchangeArray[index] = currencyData.exchanges[exchange_name];
+        exchangeArray[index] = withExchangeMetadata(exchange_name, currencyData.exchanges[exchange_name]);
         index++;
     }
 
@@ -422,7 +422,22 @@ $(function(){
 
     callAPI();
 
-    setInterval(callAPI, config.refreshRate);
+    var pollAPI = function(){
+        setInterval(function(){
+            probeAPIVersion(active_API_URL, function(downloaded){
+                callAPI(function(result, status, responseObj){
+                    downloaded();
+                    renderAll(result, status, responseObj);
+                });
+            }, function(version){
+                API_data['timestamp'] = version['timestamp'];
+                renderUpdateTime();
+            });
+        }, config.refreshRate);
+    };
+    if (!subscribeAPI('all', renderAll, pollAPI)) {
+        pollAPI();
+    }
     setInterval(renderUpdateTime, 5000);
 
     renderMajorCurrencies();